@@ -0,0 +1,616 @@
+# This file is part of Elements.
+# Copyright (c) 2010 Sean Kerr. All rights reserved.
+#
+# The full license is available in the LICENSE file that was distributed with this source code.
+#
+# Author: Sean Kerr <sean@code-box.org>
+
+import errno
+import os
+import socket
+import sys
+
+from collections import deque
+from itertools   import islice
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+try:
+    from os import sendfile
+
+except ImportError:
+    sendfile = None
+
+    if sys.platform.startswith("linux"):
+        try:
+            import ctypes
+            import ctypes.util
+
+            _libc              = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            _sendfile          = _libc.sendfile64
+            _sendfile.restype  = ctypes.c_ssize_t
+            _sendfile.argtypes = (ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t)
+
+            def sendfile (out_fd, in_fd, offset, count):
+                """
+                Copy data from a file descriptor to a socket within the kernel. This mirrors os.sendfile() from newer
+                Python versions.
+
+                @param out_fd (int) The socket file descriptor.
+                @param in_fd  (int) The file descriptor.
+                @param offset (int) The file offset from which to start copying.
+                @param count  (int) The maximum length to copy.
+
+                @return (int) The length that has been copied.
+                """
+
+                length = _sendfile(out_fd, in_fd, ctypes.byref(ctypes.c_int64(offset)), count)
+
+                if length < 0:
+                    code = ctypes.get_errno()
+
+                    raise OSError(code, os.strerror(code))
+
+                return length
+
+        except (AttributeError, ImportError, OSError):
+            # no usable libc sendfile, regions will be read and sent from userspace
+            pass
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+class ReadBuffer:
+
+    def __init__ (self, size=8192, max_idle_size=262144, max_reserve_size=16777216):
+        """
+        Create a new ReadBuffer instance.
+
+        Incoming data is received directly into a bytearray, and consumed data is skipped over by moving a start
+        offset instead of rewriting the remainder. The unconsumed data is only moved to the front when there is no room
+        left behind it, and the storage grows geometrically, so buffering n bytes costs O(n) in total regardless of how
+        many reads it takes. Searches remember how far they have already looked, so waiting on a delimiter does not
+        rescan the whole buffer after every read.
+
+        @param size             (int) The initial storage size.
+        @param max_idle_size    (int) The storage is released back to its initial size once it has been fully
+                                      consumed and has grown beyond this many bytes.
+        @param max_reserve_size (int) The maximum length that reserve() will allocate ahead of the data arriving.
+        """
+
+        self._data             = bytearray(size)  # storage
+        self._end              = 0                # end offset of the unconsumed data
+        self._max_idle_size    = max_idle_size    # storage size above which an empty buffer is shrunk
+        self._max_reserve_size = max_reserve_size # maximum length reserve() will allocate ahead of time
+        self._scan_needle      = None             # needle of the last unsuccessful search
+        self._scan_offset      = 0                # offset (relative to start) at which that search can be resumed
+        self._size             = size             # initial storage size
+        self._start            = 0                # start offset of the unconsumed data
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __len__ (self):
+        """
+        Retrieve the length of the unconsumed data.
+
+        @return (int) The length.
+        """
+
+        return self._end - self._start
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def clear (self):
+        """
+        Discard all unconsumed data.
+        """
+
+        self.consume(self._end - self._start)
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def consume (self, length):
+        """
+        Discard data from the front of the buffer.
+
+        @param length (int) The length to discard.
+        """
+
+        self._start       = min(self._start + length, self._end)
+        self._scan_offset = 0
+
+        if self._start == self._end:
+            # cheap reset while there is nothing to move
+            self._start = 0
+            self._end   = 0
+
+            if len(self._data) > self._max_idle_size:
+                # a large body has been consumed, so don't hold on to its memory
+                self._data = bytearray(self._size)
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def fill (self, sock, size):
+        """
+        Receive data from a socket directly into the buffer.
+
+        @param sock (socket) The socket.
+        @param size (int)    The maximum length to receive.
+
+        @return (int) The length that has been received. 0 means the peer has closed the connection.
+        """
+
+        self.__reserve(size)
+
+        length     = sock.recv_into(memoryview(self._data)[self._end:], size)
+        self._end += length
+
+        return length
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def find (self, needle):
+        """
+        Find a needle within the unconsumed data. An unsuccessful search is resumed where it left off when the same
+        needle is searched for again before any data has been consumed.
+
+        @param needle (str) The needle.
+
+        @return (int) The offset of the needle relative to the unconsumed data, or -1 if it has not been found.
+        """
+
+        if needle == self._scan_needle:
+            offset = self._scan_offset
+
+        else:
+            offset = 0
+
+        pos = self._data.find(needle, self._start + offset, self._end)
+
+        if pos > -1:
+            return pos - self._start
+
+        # the needle may straddle the end of the data, so the next search starts just before it
+        self._scan_needle = needle
+        self._scan_offset = max(0, self._end - self._start - len(needle) + 1)
+
+        return -1
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def getvalue (self):
+        """
+        Retrieve a copy of the unconsumed data.
+
+        @return (str) The data.
+        """
+
+        return buffer(self._data, self._start, self._end - self._start)[:]
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def peek (self, length, offset=0):
+        """
+        Retrieve a copy of unconsumed data without consuming it.
+
+        @param length (int) The length.
+        @param offset (int) The offset relative to the unconsumed data.
+
+        @return (str) The data.
+        """
+
+        return buffer(self._data, self._start + offset, max(0, min(length, self._end - self._start - offset)))[:]
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def read (self, length):
+        """
+        Consume data from the front of the buffer.
+
+        @param length (int) The length.
+
+        @return (str) The data.
+        """
+
+        data = buffer(self._data, self._start, min(length, self._end - self._start))[:]
+
+        self.consume(length)
+
+        return data
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def reserve (self, length):
+        """
+        Make sure the buffer can hold a certain length of unconsumed data without growing again. This is a hint for
+        when the length of the incoming data is known, and is limited to the maximum reserve size.
+
+        @param length (int) The total length of unconsumed data that is expected.
+        """
+
+        self.__reserve(min(length, self._max_reserve_size) - (self._end - self._start))
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def view (self, length):
+        """
+        Retrieve a memoryview of unconsumed data without copying it. The view is only valid until the next call to
+        fill() or write(), so it must not be kept.
+
+        @param length (int) The length.
+
+        @return (memoryview) The view.
+        """
+
+        return memoryview(self._data)[self._start:self._start + min(length, self._end - self._start)]
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def write (self, data):
+        """
+        Append data onto the buffer.
+
+        @param data (str) The data.
+        """
+
+        length = len(data)
+
+        self.__reserve(length)
+
+        self._data[self._end:self._end + length]  = data
+        self._end                                += length
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __reserve (self, size):
+        """
+        Make room for a certain length of data behind the unconsumed data.
+
+        @param size (int) The length.
+        """
+
+        data     = self._data
+        capacity = len(data)
+
+        if capacity - self._end >= size:
+            return
+
+        length = self._end - self._start
+
+        if self._start:
+            # move the unconsumed data to the front (the slice is copied first, because the regions may overlap)
+            data[:length] = data[self._start:self._end]
+
+            self._end   = length
+            self._start = 0
+
+        if capacity - length < size:
+            # grow geometrically so a large body is only copied a logarithmic number of times
+            self._data = bytearray(max(capacity * 2, length + size))
+
+            self._data[:length] = buffer(data, 0, length)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+class FileRegion:
+
+    def __init__ (self, file, offset, length, read_size=131070, close=True):
+        """
+        Create a new FileRegion instance.
+
+        A region of a file that is queued for sending. The region is sent with sendfile() when it is available, so the
+        file contents go from the page cache to the socket without passing through Python. Otherwise, or when the file
+        doesn't support sendfile(), it is read and sent in read_size pieces.
+
+        The region takes ownership of the file, and closes it once it has been sent or discarded. Several regions of
+        one file can share it by leaving the file open in all but the region that is queued last.
+
+        @param file      (file) The file.
+        @param offset    (int)  The offset at which the region starts.
+        @param length    (int)  The length of the region.
+        @param read_size (int)  The length to read at a time when sendfile() cannot be used.
+        @param close     (bool) Indicates that the file will be closed along with the region.
+        """
+
+        self._data        = None           # data that has been read but not yet sent (userspace fallback)
+        self._data_offset = 0              # length of the read data that has already been sent
+        self._file        = file           # file
+        self._is_closing  = close          # indicates that the file is closed along with the region
+        self._is_fallback = not sendfile   # indicates that the region is read and sent from userspace
+        self._length      = length         # remaining length
+        self._offset      = offset         # offset of the remaining region
+        self._read_size   = read_size      # length to read at a time for the userspace fallback
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __len__ (self):
+        """
+        Retrieve the remaining length.
+
+        @return (int) The length.
+        """
+
+        return self._length
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def close (self):
+        """
+        Close the file, unless it's shared with a region that is queued after this one.
+        """
+
+        if not self._is_closing:
+            return
+
+        try:
+            self._file.close()
+
+        except:
+            pass
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def peek (self, length):
+        """
+        Retrieve a copy of the remaining region without sending it.
+
+        @param length (int) The length.
+
+        @return (str) The data.
+        """
+
+        if self._data is not None:
+            data = self._data[self._data_offset:self._data_offset + length]
+
+        else:
+            data = ""
+
+        if len(data) < length:
+            self._file.seek(self._offset + len(data))
+
+            data += self._file.read(min(length, self._length) - len(data))
+
+        return data
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def send (self, sock):
+        """
+        Send as much of the remaining region as the socket will accept.
+
+        @param sock (socket) The socket.
+
+        @return (int) The length that has been sent.
+        """
+
+        if not self._is_fallback:
+            try:
+                length = sendfile(sock.fileno(), self._file.fileno(), self._offset, self._length)
+
+            except OSError, e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise socket.error(e.errno, e.strerror)
+
+                if e.errno not in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+                    raise
+
+                # the file or socket type isn't supported by sendfile()
+                self._is_fallback = True
+
+                return self.send(sock)
+
+            if not length:
+                raise socket.error(errno.EIO, "File was truncated while it was being sent")
+
+        else:
+            if self._data is None:
+                self._file.seek(self._offset)
+
+                self._data        = self._file.read(min(self._length, self._read_size))
+                self._data_offset = 0
+
+                if not self._data:
+                    raise socket.error(errno.EIO, "File was truncated while it was being sent")
+
+            length             = sock.send(buffer(self._data, self._data_offset))
+            self._data_offset += length
+
+            if self._data_offset == len(self._data):
+                self._data = None
+
+        self._length -= length
+        self._offset += length
+
+        return length
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+class WriteQueue:
+
+    def __init__ (self, gather_size=65536):
+        """
+        Create a new WriteQueue instance.
+
+        Outgoing data is kept as a queue of the chunks that were written, so nothing is concatenated when it is queued
+        and a partial send only moves an offset into the first chunk. Large chunks are sent straight out of the queue
+        without being copied. Runs of small chunks (response headers, chunked encoding framing) are joined into a
+        single send of up to gather_size bytes, because sendmsg() is not available to gather them in the kernel.
+
+        @param gather_size (int) The maximum length of small chunks that will be joined into a single send. Chunks at
+                                 least this long are always sent on their own.
+        """
+
+        self._chunks      = deque()     # pending chunks
+        self._gather_size = gather_size # maximum length of joined small chunks
+        self._offset      = 0           # length of the first chunk that has already been sent
+        self._size        = 0           # total pending length
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __len__ (self):
+        """
+        Retrieve the total pending length.
+
+        @return (int) The length.
+        """
+
+        return self._size
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def append (self, data):
+        """
+        Queue a chunk of data. The chunk must not be modified until it has been sent.
+
+        @param data (str/buffer/FileRegion) The data.
+        """
+
+        length = len(data)
+
+        if length:
+            self._chunks.append(data)
+
+            self._size += length
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def clear (self):
+        """
+        Discard all pending data.
+        """
+
+        for chunk in self._chunks:
+            if isinstance(chunk, FileRegion):
+                chunk.close()
+
+        self._chunks.clear()
+
+        self._offset = 0
+        self._size   = 0
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def peek (self, length):
+        """
+        Retrieve a copy of pending data without sending it.
+
+        @param length (int) The length.
+
+        @return (str) The data.
+        """
+
+        pieces = []
+
+        for chunk in self._chunks:
+            if length <= 0:
+                break
+
+            if isinstance(chunk, FileRegion):
+                pieces.append(chunk.peek(length))
+
+            else:
+                if not pieces and self._offset:
+                    chunk = buffer(chunk, self._offset)
+
+                pieces.append(str(buffer(chunk, 0, length)))
+
+            length -= len(pieces[-1])
+
+        return "".join(pieces)
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def send (self, sock):
+        """
+        Send as much pending data as the socket will accept.
+
+        @param sock (socket) The socket.
+
+        @return (int) The length that has been sent. If less than the total pending length was sent, the socket send
+                      buffer is full.
+        """
+
+        chunks = self._chunks
+        total  = 0
+
+        while chunks:
+            data = self.__gather()
+            size = len(data)
+
+            try:
+                if isinstance(data, FileRegion):
+                    # the region keeps track of its own progress
+                    length = data.send(sock)
+
+                    if length == size:
+                        data.close()
+
+                else:
+                    length        = sock.send(data)
+                    self._offset += length
+
+            except socket.error, e:
+                if not total or e[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+
+                break
+
+            total       += length
+            self._size  -= length
+
+            if length < size:
+                # the socket send buffer is full
+                break
+
+            chunks.popleft()
+
+            self._offset = 0
+
+        return total
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __gather (self):
+        """
+        Retrieve the next block of data to send. Small chunks at the front of the queue are joined together, and the
+        joined chunk replaces them in the queue so they are never joined twice.
+
+        @return (str/buffer/FileRegion) The data.
+        """
+
+        chunks = self._chunks
+        first  = chunks[0]
+
+        if isinstance(first, FileRegion):
+            return first
+
+        if self._offset:
+            first = buffer(first, self._offset)
+
+        length = len(first)
+
+        if length >= self._gather_size or len(chunks) == 1:
+            return first
+
+        pieces = [first]
+
+        for chunk in islice(chunks, 1, None):
+            if length + len(chunk) > self._gather_size or isinstance(chunk, FileRegion):
+                break
+
+            pieces.append(chunk)
+
+            length += len(chunk)
+
+        if len(pieces) == 1:
+            return first
+
+        for i in xrange(len(pieces)):
+            chunks.popleft()
+
+        data = "".join([piece if type(piece) is str else str(piece) for piece in pieces])
+
+        chunks.appendleft(data)
+
+        self._offset = 0
+
+        return data
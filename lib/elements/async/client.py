@@ -6,11 +6,7 @@
 # Author: Sean Kerr <sean@code-box.org>
 # Author: Noah Fontes <nfontes@invectorate.com>
 
-try:
-    import cStringIO as StringIO
-except:
-    import StringIO
-
+import errno
 import new
 import os
 import socket
@@ -18,6 +14,9 @@ import time
 
 import settings
 
+from elements.async.buffer   import FileRegion
+from elements.async.buffer   import ReadBuffer
+from elements.async.buffer   import WriteQueue
 from elements.core.exception import ChannelException
 from elements.core.exception import ClientException
 
@@ -74,16 +73,18 @@ class Client:
         self._is_channel       = False                  # indicates that this client is a channel
         self._is_host          = False                  # indicates that this client is a host
         self._last_access_time = time.time()            # last access time for this client
-        self._read_buffer      = StringIO.StringIO()    # incoming data buffer
+        self._read_buffer      = ReadBuffer()           # incoming data buffer
         self._read_callback    = None                   # method to execute on the occurence of a read event
         self._read_delimiter   = None                   # needle to find in the incoming data buffer
         self._read_length      = None                   # length of data to read
         self._read_max_bytes   = None                   # maximum read buffer length when using read_delimiter()
         self._read_size        = 4096                   # maximum bytes to read from the client socket
+        self._read_view        = False                  # indicates that the read callback accepts a memoryview
+        self._ready_events     = 0                      # events the socket is known to be ready for (edge-triggered)
         self._server           = server                 # server instance
         self._server_address   = server_address         # server address
-        self._write_buffer     = StringIO.StringIO()    # outgoing data buffer
-        self._write_index      = 0                      # write buffer index
+        self._timeout_index    = None                   # idle timeout bucket (managed by the server TimingWheel)
+        self._write_queue      = WriteQueue()           # outgoing data queue
 
         # disable blocking
         client_socket.setblocking(0)
@@ -104,9 +105,7 @@ class Client:
         Clear the write buffer.
         """
 
-        self._write_buffer.truncate(0)
-
-        self._write_index = 0
+        self._write_queue.clear()
 
     # ------------------------------------------------------------------------------------------------------------------
 
@@ -150,21 +149,35 @@ class Client:
         This callback will be executed when read data is available.
         """
 
-        data = self._client_socket.recv(self._read_size)
+        size = self._read_size
+
+        if self._read_length:
+            # a known length is outstanding, so read as much of it as the socket will give us in one go
+            size = max(size, min(self._read_length - len(self._read_buffer), 65536))
+
+        try:
+            length = self._read_buffer.fill(self._client_socket, size)
+
+        except socket.error, e:
+            if e[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+            # the socket has been drained
+            self._ready_events &= ~EVENT_READ
 
-        if len(data) == 0:
+            return
+
+        if length == 0:
             # the client closed the connection
             self._events = 0
 
             return
 
-        self._read_buffer.write(data)
-
-        if self._read_delimiter:
-            self.read_delimiter(self._read_delimiter, self._read_callback, self._read_max_bytes)
+        if length < size:
+            # a short read means the socket has been drained, the next arriving data will trigger a new event
+            self._ready_events &= ~EVENT_READ
 
-        elif self._read_length:
-            self.read_length(self._read_length, self._read_callback)
+        self.process_read_buffer()
 
     # ------------------------------------------------------------------------------------------------------------------
 
@@ -173,14 +186,36 @@ class Client:
         This callback will be executed when read data is available. All read data will be printed to console.
         """
 
-        data = self._client_socket.recv(self._read_size)
+        size = self._read_size
+
+        if self._read_length:
+            # a known length is outstanding, so read as much of it as the socket will give us in one go
+            size = max(size, min(self._read_length - len(self._read_buffer), 65536))
+
+        try:
+            length = self._read_buffer.fill(self._client_socket, size)
 
-        if len(data) == 0:
+        except socket.error, e:
+            if e[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+            # the socket has been drained
+            self._ready_events &= ~EVENT_READ
+
+            return
+
+        if length == 0:
             # the client closed the connection
             self._events = 0
 
             return
 
+        if length < size:
+            # a short read means the socket has been drained, the next arriving data will trigger a new event
+            self._ready_events &= ~EVENT_READ
+
+        data = self._read_buffer.peek(length, len(self._read_buffer) - length)
+
         print "> Data (%s:%d) %d bytes" % (self._client_address[0], self._client_address[1], len(data))
 
         if settings.io_display_data:
@@ -195,13 +230,7 @@ class Client:
             else:
                 print ">>", self.debug_replace(data)
 
-        self._read_buffer.write(data)
-
-        if self._read_delimiter:
-            self.read_delimiter(self._read_delimiter, self._read_callback, self._read_max_bytes)
-
-        elif self._read_length:
-            self.read_length(self._read_length, self._read_callback)
+        self.process_read_buffer()
 
     # ------------------------------------------------------------------------------------------------------------------
 
@@ -210,6 +239,9 @@ class Client:
         This callback will be executed when this Client instance is shutting down.
         """
 
+        # close any files that are still queued
+        self._write_queue.clear()
+
         try:
             self._client_socket.close()
 
@@ -236,29 +268,30 @@ class Client:
         This callback will be executed when write data is available.
         """
 
-        buffer = self._write_buffer
-        data   = buffer.getvalue()
-        chunk  = data[self._write_index:]
-        length = self._client_socket.send(chunk)
+        queue = self._write_queue
+
+        try:
+            queue.send(self._client_socket)
+
+        except socket.error, e:
+            if e[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
 
-        # increase the write index (this helps cut back on small writes)
-        self._write_index += length
+            # the socket send buffer is full
+            self._ready_events &= ~EVENT_WRITE
 
-        if length == len(chunk):
-            # write buffer has been entirely written
+            return
+
+        if not queue:
+            # write queue has been entirely written
             self._events &= ~EVENT_WRITE
 
             self.handle_write_finished()
 
             return
 
-        # there is more data to write
-        # note: we speed up small writes by eliminating the seek/truncate/write on every call
-        if self._write_index >= 65535:
-            buffer.truncate(0)
-            buffer.write(data[self._write_index:])
-
-            self._write_index = 0
+        # there is more data to write, but a short write means the socket send buffer is full
+        self._ready_events &= ~EVENT_WRITE
 
     # ------------------------------------------------------------------------------------------------------------------
 
@@ -267,10 +300,20 @@ class Client:
         This callback will be executed when write data is available.
         """
 
-        buffer = self._write_buffer
-        data   = buffer.getvalue()
-        chunk  = data[self._write_index:]
-        length = self._client_socket.send(chunk)
+        queue = self._write_queue
+        data  = queue.peek(len(queue))
+
+        try:
+            length = queue.send(self._client_socket)
+
+        except socket.error, e:
+            if e[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+            # the socket send buffer is full
+            self._ready_events &= ~EVENT_WRITE
+
+            return
 
         print "< Data (%s:%d) %d bytes" % (self._client_address[0], self._client_address[1], length)
 
@@ -278,32 +321,24 @@ class Client:
             if settings.io_display_ord:
                 print "<<",
 
-                for char in chunk[:length]:
+                for char in data[:length]:
                     print "'%s' %d" % (self.debug_replace(char), ord(char)),
 
                 print
 
             else:
-                print "<<", self.debug_replace(chunk[:length])
-
-        # increase the write index (this helps cut back on small writes)
-        self._write_index += length
+                print "<<", self.debug_replace(data[:length])
 
-        if length == len(chunk):
-            # write buffer has been entirely written
+        if not queue:
+            # write queue has been entirely written
             self._events &= ~EVENT_WRITE
 
             self.handle_write_finished()
 
             return
 
-        # there is more data to write
-        # note: we speed up small writes by eliminating the seek/truncate/write on every call
-        if self._write_index >= 65535:
-            buffer.truncate(0)
-            buffer.write(data[self._write_index:])
-
-            self._write_index = 0
+        # there is more data to write, but a short write means the socket send buffer is full
+        self._ready_events &= ~EVENT_WRITE
 
     # ------------------------------------------------------------------------------------------------------------------
 
@@ -316,18 +351,42 @@ class Client:
 
     # ------------------------------------------------------------------------------------------------------------------
 
-    def read_delimiter (self, delimiter, callback, max_bytes=0):
+    def process_read_buffer (self):
+        """
+        Pass buffered data to the pending read callback. This repeats for as long as each callback leaves another read
+        pending that the buffered data can satisfy, so several messages that arrived together are handled at once.
+        """
+
+        buffer = self._read_buffer
+
+        while self._events and (self._read_delimiter or self._read_length):
+            length = len(buffer)
+
+            if self._read_delimiter:
+                self.read_delimiter(self._read_delimiter, self._read_callback, self._read_max_bytes, self._read_view)
+
+            else:
+                self.read_length(self._read_length, self._read_callback, self._read_view)
+
+            if len(buffer) == length:
+                # the pending read is waiting on more data
+                break
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def read_delimiter (self, delimiter, callback, max_bytes=0, view=False):
         """
         Read until a certain delimiter has been found within the read buffer.
 
         @param delimiter (str)    The delimiter to find.
         @param callback  (method) The callback to execute once the delimiter has been found.
         @param max_bytes (int)    The maximum byte limit to read.
+        @param view      (bool)   Indicates that the callback will be passed a memoryview instead of a copy of the
+                                  data. The view is only valid until the callback returns.
         """
 
         buffer = self._read_buffer
-        data   = buffer.getvalue()
-        pos    = data.find(delimiter)
+        pos    = buffer.find(delimiter)
 
         if pos > -1:
             # the delimiter has been found
@@ -344,15 +403,20 @@ class Client:
 
             pos += len(delimiter)
 
-            buffer.truncate(0)
-            buffer.write(data[pos:])
+            if view:
+                data = buffer.view(pos)
+
+                buffer.consume(pos)
+
+            else:
+                data = buffer.read(pos)
 
-            callback(data[:pos])
+            callback(data)
 
             return
 
         # the delimiter still hasn't been sent
-        if max_bytes and len(data) >= max_bytes:
+        if max_bytes and len(buffer) >= max_bytes:
             # the maximum byte limit has been reached
             self._read_delimiter = None
 
@@ -368,47 +432,88 @@ class Client:
         self._read_callback   = callback
         self._read_delimiter  = delimiter
         self._read_max_bytes  = max_bytes
+        self._read_view       = view
 
     # ------------------------------------------------------------------------------------------------------------------
 
-    def read_length (self, length, callback):
+    def read_length (self, length, callback, view=False):
         """
         Read a certain length of data.
 
         @param length   (int)    The length to read.
         @param callback (method) The callback to execute once the length has been read entirely.
+        @param view     (bool)   Indicates that the callback will be passed a memoryview instead of a copy of the
+                                 data. The view is only valid until the callback returns.
         """
 
-        if self._read_buffer.tell() >= length:
+        buffer = self._read_buffer
+
+        if len(buffer) >= length:
             # the read buffer has met our length requirement
             self._events      &= ~EVENT_READ
             self._read_length  = None
 
-            buffer = self._read_buffer
-            data   = buffer.getvalue()
+            if view:
+                data = buffer.view(length)
 
-            buffer.truncate(0)
-            buffer.write(data[length:])
+                buffer.consume(length)
 
-            callback(data[:length])
+            else:
+                data = buffer.read(length)
+
+            callback(data)
 
             return
 
+        if length != self._read_length:
+            # allocate the buffer once, instead of growing it as the data arrives
+            buffer.reserve(length)
+
         # there is still more to read
         self._events        |= EVENT_READ
         self._read_callback  = callback
         self._read_length    = length
+        self._read_view      = view
 
     # ------------------------------------------------------------------------------------------------------------------
 
     def write (self, data):
         """
-        Append data onto the write buffer.
+        Append data onto the write queue. The data is queued as is, so it must not be modified after it has been
+        written.
 
-        @param data (str) The data to write.
+        @param data (str/buffer) The data to write.
         """
 
-        self._write_buffer.write(data)
+        self._write_queue.append(data)
+
+        self._events |= EVENT_WRITE
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def write_file (self, file, offset=0, length=None, close=True):
+        """
+        Append a region of a file onto the write queue. The region is sent with sendfile() when the platform supports
+        it, so its contents never have to be read into memory. The file will be closed once it has been sent, or when
+        this client shuts down.
+
+        @param file   (file) The file.
+        @param offset (int)  The offset at which to start.
+        @param length (int)  The length to send. If this is None, the rest of the file will be sent.
+        @param close  (bool) Indicates that the file will be closed along with the region. Pass False for every region
+                             but the last when several regions of the same file are written.
+        """
+
+        if length is None:
+            length = os.fstat(file.fileno()).st_size - offset
+
+        if length <= 0:
+            if close:
+                file.close()
+
+            return
+
+        self._write_queue.append(FileRegion(file, offset, length, close=close))
 
         self._events |= EVENT_WRITE
 
@@ -476,44 +581,123 @@ class HostClient (Client):
 
         Client.__init__(self, host_socket, host_address, server, None)
 
+        self._accepts       = 0                    # count of connections accepted
         self._handle_client = server.handle_client
         self._is_host       = True
+        self._wakeups       = 0                    # count of read events handled, each accepting a batch of connections
 
     # ------------------------------------------------------------------------------------------------------------------
 
     def handle_read (self):
         """
-        Accept a new client connection.
+        Accept the pending client connections, up to the server accept batch size.
         """
 
-        client_socket, client_address = self._client_socket.accept()
+        accept = self._client_socket.accept
+
+        # when the server limits the connections accepted per loop iteration, the rest of the pending connections are
+        # left for the next one, so the clients that are already connected get their turn during a burst
+        count = self._server.reserve_accepts()
+
+        if count <= 0:
+            return
+
+        self._wakeups += 1
+
+        accepted = 0
 
         try:
-            self._handle_client(client_socket, client_address, self._client_address)
+            while accepted < count:
+                try:
+                    client_socket, client_address = accept()
+
+                except socket.error, e:
+                    if e[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        raise
 
-        except Exception, e:
-            client_socket.close()
+                    # there are no more pending connections (another worker may have accepted them)
+                    self._ready_events &= ~EVENT_READ
 
-            raise ClientException("Cannot create client: %s" % e)
+                    return
+
+                accepted      += 1
+                self._accepts += 1
+
+                try:
+                    self._handle_client(client_socket, client_address, self._client_address)
+
+                except Exception, e:
+                    client_socket.close()
+
+                    raise ClientException("Cannot create client: %s" % e)
+
+        finally:
+            # whatever wasn't accepted is given back, even when accepting fails, so the other hosts can use it
+            self._server.release_accepts(count - accepted)
 
     # ------------------------------------------------------------------------------------------------------------------
 
     def handle_read_debug (self):
         """
-        Accept a new client connection.
+        Accept the pending client connections, up to the server accept batch size.
 
         Note: This debugging method is an exact duplicate of HostClient.handle_read() and is only here because it's a
               necessity during i/o debugging.
         """
 
-        client_socket, client_address = self._client_socket.accept()
+        accept = self._client_socket.accept
 
-        print "> New client (%s:%d)" % client_address
+        # when the server limits the connections accepted per loop iteration, the rest of the pending connections are
+        # left for the next one, so the clients that are already connected get their turn during a burst
+        count = self._server.reserve_accepts()
+
+        if count <= 0:
+            return
+
+        self._wakeups += 1
+
+        accepted = 0
 
         try:
-            self._handle_client(client_socket, client_address, self._client_address)
+            while accepted < count:
+                try:
+                    client_socket, client_address = accept()
 
-        except Exception, e:
-            client_socket.close()
+                except socket.error, e:
+                    if e[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        raise
+
+                    # there are no more pending connections (another worker may have accepted them)
+                    self._ready_events &= ~EVENT_READ
+
+                    return
+
+                accepted      += 1
+                self._accepts += 1
+
+                print "> New client (%s:%d)" % client_address
+
+                try:
+                    self._handle_client(client_socket, client_address, self._client_address)
+
+                except Exception, e:
+                    client_socket.close()
+
+                    raise ClientException("Cannot create client: %s" % e)
+
+        finally:
+            # whatever wasn't accepted is given back, even when accepting fails, so the other hosts can use it
+            self._server.release_accepts(count - accepted)
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def stats (self):
+        """
+        Retrieve the accept counters.
+
+        @return (dict) The number of connections accepted, wakeups, and connections accepted per wakeup.
+        """
 
-            raise ClientException("Cannot create client: %s" % e)
+        return { "accepts":            self._accepts,
+                 "accepts_per_wakeup": float(self._accepts) / self._wakeups if self._wakeups else 0.0,
+                 "wakeups":            self._wakeups }
@@ -0,0 +1,149 @@
+# This file is part of Elements.
+# Copyright (c) 2010 Sean Kerr. All rights reserved.
+#
+# The full license is available in the LICENSE file that was distributed with this source code.
+#
+# Author: Sean Kerr <sean@code-box.org>
+
+import math
+import os
+
+from elements.core.exception import ServerException
+
+try:
+    import ctypes
+    import ctypes.util
+
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+
+    # raises an AttributeError on platforms that have no scheduler affinity calls
+    libc.sched_getaffinity
+    libc.sched_setaffinity
+
+except (AttributeError, ImportError, OSError):
+    libc = None
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+CPU_SETSIZE = 1024 # number of cpus that fit in a cpu_set_t
+
+# cgroup cpu quota files, as they're mounted within a container (v2 first, then v1)
+CGROUP_CPU_MAX    = "/sys/fs/cgroup/cpu.max"
+CGROUP_CPU_PERIOD = "/sys/fs/cgroup/cpu/cpu.cfs_period_us"
+CGROUP_CPU_QUOTA  = "/sys/fs/cgroup/cpu/cpu.cfs_quota_us"
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+def available_cpus ():
+    """
+    Retrieve the cpus on which the current process is allowed to run.
+
+    @return (list) The sorted cpu numbers.
+    """
+
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+
+    if not libc:
+        raise ServerException("Cannot retrieve the cpu affinity, because this platform does not support this feature")
+
+    mask = (ctypes.c_ulong * (CPU_SETSIZE / (8 * ctypes.sizeof(ctypes.c_ulong))))()
+    bits = 8 * ctypes.sizeof(ctypes.c_ulong)
+
+    if libc.sched_getaffinity(0, ctypes.sizeof(mask), mask) != 0:
+        raise ServerException("Cannot retrieve the cpu affinity: %s" % os.strerror(ctypes.get_errno()))
+
+    return [cpu for cpu in xrange(CPU_SETSIZE) if mask[cpu / bits] & (1 << (cpu % bits))]
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+def cpu_count ():
+    """
+    Retrieve the number of cpus the current process can keep busy, which is the number of cpus it's allowed to run on,
+    limited by the cgroup cpu quota.
+
+    @return (int) The cpu count.
+    """
+
+    if hasattr(os, "sched_getaffinity") or libc:
+        count = len(available_cpus())
+
+    else:
+        try:
+            count = os.sysconf("SC_NPROCESSORS_ONLN")
+
+        except (AttributeError, ValueError, OSError):
+            count = 1
+
+    quota = cpu_quota()
+
+    if quota:
+        count = min(count, int(math.ceil(quota)))
+
+    return max(1, count)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+def cpu_quota ():
+    """
+    Retrieve the cgroup cpu quota.
+
+    @return (float) The number of cpus worth of time the cgroup may use, or None if there is no quota.
+    """
+
+    try:
+        if os.path.exists(CGROUP_CPU_MAX):
+            quota, period = open(CGROUP_CPU_MAX).read().split()
+
+        else:
+            quota  = open(CGROUP_CPU_QUOTA).read().strip()
+            period = open(CGROUP_CPU_PERIOD).read().strip()
+
+        if quota in ("max", "-1"):
+            return None
+
+        return float(quota) / float(period)
+
+    except (IOError, ValueError, ZeroDivisionError):
+        return None
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+def is_affinity_supported ():
+    """
+    Indicates that the cpu affinity of a process can be changed on this platform.
+
+    @return (bool) True, if the cpu affinity can be changed, otherwise False.
+    """
+
+    return hasattr(os, "sched_setaffinity") or libc is not None
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+def set_affinity (cpus):
+    """
+    Restrict the current process to a set of cpus.
+
+    @param cpus (list) The cpu numbers.
+    """
+
+    if hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, cpus)
+
+            return
+
+        except OSError, e:
+            raise ServerException("Cannot set the cpu affinity to %s: %s" % (list(cpus), e))
+
+    if not libc:
+        raise ServerException("Cannot set the cpu affinity, because this platform does not support this feature")
+
+    mask = (ctypes.c_ulong * (CPU_SETSIZE / (8 * ctypes.sizeof(ctypes.c_ulong))))()
+    bits = 8 * ctypes.sizeof(ctypes.c_ulong)
+
+    for cpu in cpus:
+        mask[cpu / bits] |= 1 << (cpu % bits)
+
+    if libc.sched_setaffinity(0, ctypes.sizeof(mask), mask) != 0:
+        raise ServerException("Cannot set the cpu affinity to %s: %s" % (list(cpus), os.strerror(ctypes.get_errno())))
@@ -5,6 +5,7 @@
 #
 # Author: Sean Kerr <sean@code-box.org>
 
+import math
 import select
 
 from elements.core.exception import EventException
@@ -17,10 +18,56 @@ class EventManager:
         """
         Create a new EventManager instance.
 
+        Registrations and modifications are not applied right away. They are kept in a table of pending changes keyed
+        by file descriptor, so a descriptor that changes several times during one pass of the event loop costs at most
+        one kernel call, and a change that ends up where it started costs none. The table is flushed at the start of
+        each poll(). Unregistrations are applied immediately, because the descriptor is usually closed right after.
+
         @param server (Server) The Server instance under which this EventManager is being created.
         """
 
-        self._server = server
+        self._changes = {}     # file descriptor -> events that have not been applied yet
+        self._events  = {}     # file descriptor -> events that have been applied
+        self._failed  = []     # file descriptors whose changes could not be applied
+        self._server  = server
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def flush (self):
+        """
+        Apply all pending registrations and modifications.
+        """
+
+        if not self._changes:
+            return
+
+        applied  = self._events
+        changes  = self._changes
+        modify   = self._modify
+        register = self._register
+
+        self._changes = {}
+
+        for fileno, events in changes.iteritems():
+            current = applied.get(fileno)
+
+            if current == events:
+                # the changes cancelled each other out
+                continue
+
+            try:
+                if current is None:
+                    register(fileno, events)
+
+                else:
+                    modify(fileno, events, current)
+
+                applied[fileno] = events
+
+            except (IOError, OSError):
+                # the descriptor was most likely closed before the change could be applied, either way its client can
+                # no longer be served, so it's reported as an error event by the next poll() and then unregistered
+                self._failed.append(fileno)
 
     # ------------------------------------------------------------------------------------------------------------------
 
@@ -32,13 +79,16 @@ class EventManager:
         @param events (int) The events.
         """
 
-        raise EventException("EventManager.modify() must be overridden")
+        if fileno in self._events or fileno in self._changes:
+            self._changes[fileno] = events
 
     # ------------------------------------------------------------------------------------------------------------------
 
-    def poll (self):
+    def poll (self, timeout=None):
         """
         Poll the event manager for more events.
+
+        @param timeout (float) The maximum number of seconds to block, or None to block until an event occurs.
         """
 
         raise EventException("EventManager.poll() must be overridden")
@@ -53,18 +103,61 @@ class EventManager:
         @param events (int) The events.
         """
 
-        raise EventException("EventManager.register() must be overridden")
+        self._changes[fileno] = events
 
     # ------------------------------------------------------------------------------------------------------------------
 
-    def unregister (self):
+    def unregister (self, fileno):
         """
         Unregister a file descriptor.
 
         @param fileno (int) The file descriptor.
         """
 
-        raise EventException("EventManager.unregister() must be overridden")
+        self._changes.pop(fileno, None)
+
+        events = self._events.pop(fileno, None)
+
+        if events is not None:
+            # the descriptor is only known to the kernel once its registration has been flushed
+            self._unregister(fileno, events)
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def _modify (self, fileno, events, current):
+        """
+        Apply a modification.
+
+        @param fileno  (int) The file descriptor.
+        @param events  (int) The new events.
+        @param current (int) The events that are currently applied.
+        """
+
+        raise EventException("EventManager._modify() must be overridden")
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def _register (self, fileno, events):
+        """
+        Apply a registration.
+
+        @param fileno (int) The file descriptor.
+        @param events (int) The events.
+        """
+
+        raise EventException("EventManager._register() must be overridden")
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def _unregister (self, fileno, current):
+        """
+        Apply an unregistration.
+
+        @param fileno  (int) The file descriptor.
+        @param current (int) The events that are currently applied.
+        """
+
+        raise EventException("EventManager._unregister() must be overridden")
 
 # ----------------------------------------------------------------------------------------------------------------------
 
@@ -89,31 +182,32 @@ class KQueueEventManager (EventManager):
 
     # ------------------------------------------------------------------------------------------------------------------
 
-    def modify (self, fileno, events):
+    def flush (self):
         """
-        Modify the event list for a file descriptor.
-
-        @param fileno (int) The file descriptor.
-        @param events (int) The events.
+        Apply all pending registrations and modifications with a single kevent() call.
         """
 
-        if events & self.EVENT_READ:
-            self._kqueue.control([select.kevent(fileno, select.KQ_FILTER_READ, select.KQ_EV_ADD)], 0)
+        changelist = self.__build_changelist()
 
-        if events & self.EVENT_WRITE:
-            self._kqueue.control([select.kevent(fileno, select.KQ_FILTER_WRITE, select.KQ_EV_ADD)], 0)
+        if changelist:
+            self._kqueue.control(changelist, 0)
 
     # ------------------------------------------------------------------------------------------------------------------
 
-    def poll (self):
+    def poll (self, timeout=None):
         """
-        Poll the event manager for more events.
+        Poll the event manager for more events. Pending changes are submitted as part of the same kevent() call.
+
+        @param timeout (float) The maximum number of seconds to block, or None to block until an event occurs.
         """
 
         events = {}
 
-        for event in self._kqueue.control(None, self._count, 0.5):
-            events[event.ident] = 0
+        # a change that fails is reported back as an event with KQ_EV_ERROR set, so leave room for one per change
+        changelist = self.__build_changelist()
+
+        for event in self._kqueue.control(changelist, self._count + len(changelist), timeout):
+            events[event.ident] = events.get(event.ident, 0)
 
             if event.flags & select.KQ_EV_ERROR:
                 events[event.ident] |= self.EVENT_ERROR
@@ -128,34 +222,69 @@ class KQueueEventManager (EventManager):
 
     # ------------------------------------------------------------------------------------------------------------------
 
-    def register (self, fileno, events):
+    def _unregister (self, fileno, current):
         """
-        Register events for a file descriptor.
+        Apply an unregistration.
 
-        @param fileno (int) The file descriptor.
-        @param events (int) The events.
+        @param fileno  (int) The file descriptor.
+        @param current (int) The events that are currently applied.
         """
 
-        if events & self.EVENT_READ:
-            self._kqueue.control([select.kevent(fileno, select.KQ_FILTER_READ, select.KQ_EV_ADD)], 0)
+        changelist = []
 
-        if events & self.EVENT_WRITE:
-            self._kqueue.control([select.kevent(fileno, select.KQ_FILTER_WRITE, select.KQ_EV_ADD)], 0)
+        if current & self.EVENT_READ:
+            changelist.append(select.kevent(fileno, select.KQ_FILTER_READ, select.KQ_EV_DELETE))
 
-        self._count += 1
+        if current & self.EVENT_WRITE:
+            changelist.append(select.kevent(fileno, select.KQ_FILTER_WRITE, select.KQ_EV_DELETE))
+
+        self._count -= 1
+
+        if changelist:
+            self._kqueue.control(changelist, 0)
 
     # ------------------------------------------------------------------------------------------------------------------
 
-    def unregister (self, fileno):
+    def __build_changelist (self):
         """
-        Unregister a file descriptor.
+        Build the kevent changelist for all pending registrations and modifications, and mark them as applied.
 
-        @param fileno (int) The file descriptor.
+        @return (list) The changelist.
         """
 
-        self._kqueue.control([select.kevent(fileno, select.KQ_FILTER_READ, select.KQ_EV_DELETE)], 0)
+        changelist = []
 
-        self._count -= 1
+        if not self._changes:
+            return changelist
+
+        applied = self._events
+        changes = self._changes
+
+        self._changes = {}
+
+        for fileno, events in changes.iteritems():
+            current = applied.get(fileno)
+
+            if current == events:
+                # the changes cancelled each other out
+                continue
+
+            if current is None:
+                current      = 0
+                self._count += 1
+
+            # only the filters that differ from what the kernel already has are submitted
+            for event, kq_filter in ((self.EVENT_READ, select.KQ_FILTER_READ),
+                                     (self.EVENT_WRITE, select.KQ_FILTER_WRITE)):
+                if events & event and not current & event:
+                    changelist.append(select.kevent(fileno, kq_filter, select.KQ_EV_ADD))
+
+                elif current & event and not events & event:
+                    changelist.append(select.kevent(fileno, kq_filter, select.KQ_EV_DELETE))
+
+            applied[fileno] = events
+
+        return changelist
 
 # ----------------------------------------------------------------------------------------------------------------------
 
@@ -179,30 +308,62 @@ class PollEventManager (EventManager):
 
     # ------------------------------------------------------------------------------------------------------------------
 
-    def modify (self, fileno, events):
+    def poll (self, timeout=None):
         """
-        Modify the event list for a file descriptor.
+        Poll the event manager for more events.
 
-        @param fileno (int) The file descriptor.
-        @param events (int) The events.
+        @param timeout (float) The maximum number of seconds to block, or None to block until an event occurs.
+        """
+
+        if self._changes:
+            self.flush()
+
+        if self._failed:
+            return self._poll_failed()
+
+        if timeout is None:
+            return self._poll.poll()
+
+        # poll() expects milliseconds, and a timeout that's rounded down would wake up before the deadline
+        return self._poll.poll(int(math.ceil(timeout * 1000)))
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def _modify (self, fileno, events, current):
+        """
+        Apply a modification.
+
+        @param fileno  (int) The file descriptor.
+        @param events  (int) The new events.
+        @param current (int) The events that are currently applied.
         """
 
         self._poll.modify(fileno, events)
 
     # ------------------------------------------------------------------------------------------------------------------
 
-    def poll (self):
+    def _poll_failed (self):
         """
-        Poll the event manager for more events.
+        Poll the event manager for more events without blocking, and report an error event for each file descriptor
+        whose changes could not be applied.
+
+        @return (list) The events.
         """
 
-        return self._poll.poll(0.5)
+        failed       = self._failed
+        self._failed = []
+
+        events = [(fileno, events) for fileno, events in self._poll.poll(0) if fileno not in failed]
+
+        events.extend([(fileno, self.EVENT_ERROR) for fileno in failed])
+
+        return events
 
     # ------------------------------------------------------------------------------------------------------------------
 
-    def register (self, fileno, events):
+    def _register (self, fileno, events):
         """
-        Register events for a file descriptor.
+        Apply a registration.
 
         @param fileno (int) The file descriptor.
         @param events (int) The events.
@@ -212,11 +373,12 @@ class PollEventManager (EventManager):
 
     # ------------------------------------------------------------------------------------------------------------------
 
-    def unregister (self, fileno):
+    def _unregister (self, fileno, current):
         """
-        Unregister a file descriptor.
+        Apply an unregistration.
 
-        @param fileno (int) The file descriptor.
+        @param fileno  (int) The file descriptor.
+        @param current (int) The events that are currently applied.
         """
 
         self._poll.unregister(fileno)
@@ -225,22 +387,77 @@ class PollEventManager (EventManager):
 
 class EPollEventManager (PollEventManager):
 
-    def __init__ (self, server):
+    def __init__ (self, server, edge_triggered=False):
         """
         Create a new EPollEventManager instance.
 
-        @param server (Server) The Server instance under which this EPollEventManager is being created.
+        @param server         (Server) The Server instance under which this EPollEventManager is being created.
+        @param edge_triggered (bool)   Indicates that file descriptors will be registered once for both read and write
+                                       events in edge-triggered mode. Modifications become no-ops, and clients are
+                                       expected to track their own readiness.
         """
 
         PollEventManager.__init__(self, server)
 
-        self._poll = select.epoll()
+        self._is_edge_triggered = edge_triggered
+        self._poll              = select.epoll()
 
         self.EVENT_ERROR  = select.EPOLLERR
         self.EVENT_READ   = select.EPOLLIN | select.EPOLLPRI
         self.EVENT_WRITE  = select.EPOLLOUT
         self.EVENT_LINGER = select.EPOLLHUP
 
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def modify (self, fileno, events):
+        """
+        Modify the event list for a file descriptor.
+
+        @param fileno (int) The file descriptor.
+        @param events (int) The events.
+        """
+
+        if self._is_edge_triggered:
+            # the descriptor is already registered for everything we care about
+            return
+
+        EventManager.modify(self, fileno, events)
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def poll (self, timeout=None):
+        """
+        Poll the event manager for more events.
+
+        @param timeout (float) The maximum number of seconds to block, or None to block until an event occurs.
+        """
+
+        if self._changes:
+            self.flush()
+
+        if self._failed:
+            return self._poll_failed()
+
+        if timeout is None:
+            return self._poll.poll()
+
+        return self._poll.poll(timeout)
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def _register (self, fileno, events):
+        """
+        Apply a registration.
+
+        @param fileno (int) The file descriptor.
+        @param events (int) The events.
+        """
+
+        if self._is_edge_triggered:
+            events = self.EVENT_READ | self.EVENT_WRITE | select.EPOLLET
+
+        self._poll.register(fileno, events)
+
 # ----------------------------------------------------------------------------------------------------------------------
 
 class SelectEventManager (EventManager):
@@ -293,15 +510,17 @@ class SelectEventManager (EventManager):
 
     # ------------------------------------------------------------------------------------------------------------------
 
-    def poll (self):
+    def poll (self, timeout=None):
         """
         Poll the event manager for more events.
+
+        @param timeout (float) The maximum number of seconds to block, or None to block until an event occurs.
         """
 
         events = {}
 
         read_filenos, write_filenos, error_filenos = select.select(self._read_filenos, self._write_filenos,
-                                                                   self._error_filenos, 0.5)
+                                                                   self._error_filenos, timeout)
 
         for fileno in read_filenos:
             events[fileno] = self.EVENT_READ
@@ -246,7 +246,8 @@ class _StreamRecord (_Record):
 
         @param type       (int)    The FastCGI type for the record (must be one of FASTCGI_STDOUT or FASTCGI_STDERR for
                                    our purposes).
-        @param data       (object) The data blob to be sent. This implementation sends str(data) as the message body.
+        @param data       (object) The data blob to be sent. This implementation sends str(data) as the message body,
+                                   unless data is a str or a buffer, in which case it is sent as is.
         @param request_id (int)    The request ID to which to the data belongs.
         """
 
@@ -259,9 +260,12 @@ class _StreamRecord (_Record):
         """
         Creates a message body for the given record type.
 
-        @return (str) The message body.
+        @return (str/buffer) The message body.
         """
 
+        if type(self._data) in (str, buffer):
+            return self._data
+
         return str(self._data)
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -298,11 +302,14 @@ class _OutputWriter (object):
         """
 
         if not self._closed:
-            while len(data) > 0:
-                self._client._write_record(_StreamRecord(self._type, data[:65535], self._client.request_id))
-                self._has_data = True
+            if type(data) is not str:
+                data = str(data)
 
-                data = data[65535:]
+            # each record refers to its part of the data, instead of copying the remainder for every record
+            for offset in xrange(0, len(data), 65535):
+                self._client._write_record(_StreamRecord(self._type, buffer(data, offset, 65535),
+                                                         self._client.request_id))
+                self._has_data = True
 
     # ------------------------------------------------------------------------------------------------------------------
 
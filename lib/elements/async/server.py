@@ -6,8 +6,11 @@
 # Author: Sean Kerr <sean@code-box.org>
 
 import errno
+import heapq
+import math
 import os
 import platform
+import random
 import select
 import signal
 import socket
@@ -17,12 +20,15 @@ import traceback
 from time import time
 
 from elements.async          import client
+from elements.async          import cpu
 from elements.async.client   import ChannelClient
 from elements.async.client   import HostClient
 from elements.async.event    import EPollEventManager
 from elements.async.event    import KQueueEventManager
 from elements.async.event    import PollEventManager
 from elements.async.event    import SelectEventManager
+from elements.async.timer    import Timer
+from elements.async.timer    import TimingWheel
 from elements.core.exception import ChannelException
 from elements.core.exception import ElementsException
 from elements.core.exception import HostException
@@ -30,11 +36,18 @@ from elements.core.exception import ServerException
 
 # ----------------------------------------------------------------------------------------------------------------------
 
+LISTENERS_ENV = "ELEMENTS_LISTENERS" # environment variable that hands the host listeners to a re-executed parent
+READY_FD_ENV  = "ELEMENTS_READY_FD"  # environment variable that holds the pipe on which a re-executed parent reports
+
+# ----------------------------------------------------------------------------------------------------------------------
+
 class Server:
 
     def __init__ (self, hosts=None, daemonize=False, user=None, group=None, umask=None, chroot=None, long_running=False,
                   loop_interval=1, timeout=None, timeout_interval=10, worker_count=0, channel_count=0,
-                  event_manager=None, print_settings=True):
+                  event_manager=None, print_settings=True, edge_triggered=False, reuse_port=False, accept_batch=64,
+                  accept_limit=0, pin_workers=False, restart_batch=1, max_requests=0, max_rss=0, max_age=0,
+                  limit_jitter=0.1):
         """
         Create a new Server instance.
 
@@ -49,16 +62,42 @@ class Server:
         @param loop_interval    (int/float) The interval between loop calls.
         @param timeout          (int/float) The client idle timeout.
         @param timeout_interval (int)       The interval between checks for client timeouts.
-        @param worker_count     (int)       The worker process count.
+        @param worker_count     (int/str)   The worker process count. Use "auto" for one worker per cpu that this
+                                            process can keep busy.
         @param channel_count    (int)       The communication channel count for each worker.
         @param event_manager    (str)       The event manager.
         @param print_settings   (bool)      Indicates that the server settings should be printed to the console.
+        @param edge_triggered   (bool)      Indicates that the epoll event manager should run in edge-triggered mode,
+                                            where clients are registered once and never modified.
+        @param reuse_port       (bool)      Indicates that each worker should have its own SO_REUSEPORT listener on
+                                            each host, so the kernel spreads new connections across the workers
+                                            instead of waking all of them for each connection.
+        @param accept_batch     (int)       The maximum number of connections accepted on a host each time it becomes
+                                            readable.
+        @param accept_limit     (int)       The maximum number of connections accepted on all hosts in each loop
+                                            iteration, so the clients that are already connected get their turn
+                                            during a burst. Use 0 for no limit.
+        @param pin_workers      (bool)      Indicates that each worker should be pinned to its own cpu. The parent
+                                            process is moved to the cpus that are left over, if there are any.
+        @param restart_batch    (int)       The number of workers that a rolling restart replaces at a time.
+        @param max_requests     (int)       The number of requests that a worker serves before it's recycled. Use 0
+                                            for no limit.
+        @param max_rss          (int)       The resident memory size in bytes that a worker grows to before it's
+                                            recycled. Use 0 for no limit.
+        @param max_age          (int/float) The number of seconds that a worker runs before it's recycled. Use 0 for
+                                            no limit.
+        @param limit_jitter     (float)     The fraction by which each worker lowers its limits at random, so the
+                                            workers don't all recycle at once.
         """
 
+        self._accept_batch             = accept_batch     # maximum connections accepted per host wakeup
+        self._accept_budget            = accept_limit     # connections that can still be accepted this iteration
+        self._accept_limit             = accept_limit     # maximum connections accepted per loop iteration
         self._channels                 = {}               # worker channels
         self._channel_count            = channel_count    # count of channels to be created
         self._chroot                   = chroot           # process chroot
         self._clients                  = {}               # all active clients
+        self._edge_pending             = set()            # filenos with work left over for the next edge-triggered pass
         self._event_manager            = None             # event manager instance
         self._event_manager_modify     = None             # event manager modify method
         self._event_manager_poll       = None             # event manager poll method
@@ -66,22 +105,68 @@ class Server:
         self._event_manager_unregister = None             # event manager unregister method
         self._group                    = group            # process group
         self._hosts                    = []               # host client/server sockets
+        self._inherited_hosts          = {}               # listener fds handed over by reexec(), keyed by ip/port
         self._is_daemon                = daemonize        # indicates that this is running as a daemon
+        self._is_edge_triggered        = edge_triggered   # indicates that the event manager is edge-triggered
         self._is_graceful_shutdown     = False            # indicates that the current shutdown request is graceful
         self._is_listening             = False            # indicates that this process is listening on all hosts
         self._is_long_running          = long_running     # indicates that clients are long-running
         self._is_parent                = True             # indicates that this process is the parent
+        self._is_pinned                = False            # indicates that each worker is pinned to its own cpu
+        self._is_reexec_requested      = False            # indicates that a re-execution has been signaled
+        self._is_restart_requested     = False            # indicates that a rolling restart has been signaled
+        self._is_reuse_port            = False            # indicates that each worker has its own listeners
         self._is_shutting_down         = False            # indicates that this server is shutting down
+        self._limit_jitter             = limit_jitter     # fraction by which each worker lowers its limits at random
         self._loop_interval            = loop_interval    # the interval in seconds between calling handle_loop()
+        self._max_age                  = max_age          # seconds a worker runs before it's recycled
+        self._max_requests             = max_requests     # requests a worker serves before it's recycled
+        self._max_rss                  = max_rss          # resident bytes a worker grows to before it's recycled
         self._parent_pid               = os.getpid()      # the parent process id
         self._print_settings           = print_settings   # indicates that the settings should be printed to the console
+        self._ready_fd                 = None             # pipe on which this process reports that it's ready
+        self._reexec_pid               = None             # process id of the parent started by reexec()
+        self._request_count            = 0                # count of requests served by this process
+        self._restart_batch            = restart_batch    # count of workers replaced at a time by a rolling restart
+        self._restart_queue            = []               # worker process ids waiting to be replaced
+        self._restart_replacements     = {}               # replaced worker process ids keyed by replacement id
+        self._retiring_workers         = set()            # worker process ids that are finishing their clients
+        self._start_time               = time()           # the time at which this process started
         self._timeout                  = timeout          # the timeout in seconds for a client to be removed
         self._timeout_interval         = timeout_interval # the interval in seconds between checking for idle clients
+        self._timeout_wheel            = None             # idle client deadlines
+        self._timer_cancel_count       = 0                # count of cancelled timers still sitting in the timer heap
+        self._timer_sequence           = 0                # tie-breaker for timers that are due at the same time
+        self._timers                   = []               # heap of (due time, sequence, Timer) entries
         self._umask                    = umask            # process umask
         self._user                     = user             # process user
         self._worker_count             = worker_count     # count of worker processes
+        self._worker_cpus              = []               # cpus to which the worker slots are pinned
+        self._worker_hosts             = []               # host clients for each worker slot, when reusing the port
+        self._worker_ready_fds         = {}               # pipes on which workers report that they're ready
+        self._worker_slots             = {}               # worker slots keyed by worker process id
         self._workers                  = []               # list of worker process ids
 
+        if worker_count == "auto":
+            self._worker_count = cpu.cpu_count()
+
+        # this process was started by reexec(), so the host listeners are inherited rather than opened
+        if LISTENERS_ENV in os.environ:
+            for listener in os.environ.pop(LISTENERS_ENV).split():
+                ip, port, fd = listener.rsplit(":", 2)
+
+                self._inherited_hosts.setdefault((ip, int(port)), []).append(int(fd))
+
+        if READY_FD_ENV in os.environ:
+            self._ready_fd = int(os.environ.pop(READY_FD_ENV))
+
+        if long_running:
+            # the hosts are unregistered as soon as a client connects, so only one connection may be accepted at a time
+            self._accept_batch = 1
+
+        if timeout:
+            self._timeout_wheel = TimingWheel(timeout, timeout_interval)
+
         # choose event manager
         if hasattr(select, "epoll") and (event_manager is None or event_manager == "epoll"):
             self._event_manager = EPollEventManager
@@ -90,7 +175,7 @@ class Server:
             self._event_manager = KQueueEventManager
             self._worker_count  = 0
 
-            if worker_count > 0:
+            if worker_count:
                 print "KQueue does not support parent process file descriptor inheritence, " \
                       "so workers have been disabled. If you want that ability, you must use the Select event manager."
 
@@ -103,6 +188,29 @@ class Server:
         else:
             raise ServerException("Could not find a suitable event manager for your platform")
 
+        if edge_triggered and self._event_manager != EPollEventManager:
+            self._is_edge_triggered = False
+
+            print "Edge-triggered mode is only supported by the EPoll event manager, so it has been disabled."
+
+        if pin_workers and self._worker_count > 0:
+            if not cpu.is_affinity_supported():
+                raise ServerException("Cannot pin workers, because this platform does not support cpu affinity")
+
+            # workers are pinned starting from the last cpu, so the first cpus, which usually handle most interrupts,
+            # are the ones left over for the parent
+            self._is_pinned   = True
+            self._worker_cpus = list(reversed(cpu.available_cpus()))
+
+        if reuse_port and self._worker_count > 1:
+            if not hasattr(socket, "SO_REUSEPORT"):
+                raise ServerException("Cannot reuse port, because this platform does not support SO_REUSEPORT")
+
+            # the listeners must be opened before the process user changes, because the kernel only lets sockets that
+            # belong to the same user share a port
+            self._is_reuse_port = True
+            self._worker_hosts  = [[] for i in xrange(self._worker_count)]
+
         # change directory
         if chroot:
             try:
@@ -135,11 +243,7 @@ class Server:
             self.handle_post_daemonize()
 
         # initialize the event manager methods and events
-        self._event_manager            = self._event_manager(self)
-        self._event_manager_modify     = self._event_manager.modify
-        self._event_manager_poll       = self._event_manager.poll
-        self._event_manager_register   = self._event_manager.register
-        self._event_manager_unregister = self._event_manager.unregister
+        self.__init_event_manager(self._event_manager)
 
         # update this server with the proper events
         self.EVENT_READ   = self._event_manager.EVENT_READ
@@ -185,6 +289,7 @@ class Server:
         if platform.system() != "Windows":
             #signal.signal(signal.SIGCHLD, self.handle_signal)
             signal.signal(signal.SIGHUP,  self.handle_signal)
+            signal.signal(signal.SIGUSR2, self.handle_signal)
 
         signal.signal(signal.SIGINT,  self.handle_signal)
         signal.signal(signal.SIGTERM, self.handle_signal)
@@ -202,16 +307,14 @@ class Server:
         """
 
         try:
-            host = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            client = self.__open_host(ip, port)
 
-            # disable blocking
-            host.setblocking(0)
-
-            host.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            host.bind((ip, port))
-            host.listen(socket.SOMAXCONN)
+            if self._is_reuse_port:
+                # the first worker slot uses the listener of this process, and every other slot gets its own
+                self._worker_hosts[0].append(client)
 
-            client = HostClient(host, (ip, port), self)
+                for hosts in self._worker_hosts[1:]:
+                    hosts.append(self.__open_host(ip, port))
 
             self._hosts.append(client)
 
@@ -222,6 +325,77 @@ class Server:
 
     # ------------------------------------------------------------------------------------------------------------------
 
+    def call_at (self, when, callback, *args):
+        """
+        Schedule a callback to be executed at an absolute time.
+
+        @param when     (float)  The absolute time (as returned by time.time()) at which the callback will be executed.
+        @param callback (method) The callback to execute.
+        @param args     (tuple)  The callback arguments.
+
+        @return (Timer) The Timer instance, which can be passed to cancel().
+        """
+
+        timer                 = Timer(when, callback, args)
+        self._timer_sequence += 1
+
+        heapq.heappush(self._timers, (when, self._timer_sequence, timer))
+
+        return timer
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def call_later (self, delay, callback, *args):
+        """
+        Schedule a callback to be executed after a delay.
+
+        @param delay    (int/float) The delay in seconds.
+        @param callback (method)    The callback to execute.
+        @param args     (tuple)     The callback arguments.
+
+        @return (Timer) The Timer instance, which can be passed to cancel().
+        """
+
+        return self.call_at(time() + delay, callback, *args)
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def cancel (self, timer):
+        """
+        Cancel a scheduled callback.
+
+        @param timer (Timer) The Timer instance returned by call_at() or call_later().
+        """
+
+        if timer._is_cancelled or timer._is_executed:
+            return
+
+        timer._is_cancelled       = True
+        self._timer_cancel_count += 1
+
+        # cancelled timers are lazily removed when they reach the top of the heap, but if they start to dominate the
+        # heap we rebuild it so a large amount of cancelled long-term timers doesn't turn into a memory leak
+        if self._timer_cancel_count > 512 and self._timer_cancel_count > len(self._timers) / 2:
+            self._timers[:]          = [entry for entry in self._timers if not entry[2]._is_cancelled]
+            self._timer_cancel_count = 0
+
+            heapq.heapify(self._timers)
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def count_request (self):
+        """
+        Count a request served by this process, and recycle this worker as soon as it has served its maximum number of
+        requests.
+        """
+
+        self._request_count += 1
+
+        if self._request_count == self._max_requests and not self._is_parent and not self._is_shutting_down:
+            self.__recycle("has served %d requests" % self._request_count)
+
+    # ------------------------------------------------------------------------------------------------------------------
+
     def handle_channels (self, pid, sockets):
         """
         This callback will be executed when channels need to be prepared for a worker process.
@@ -298,7 +472,7 @@ class Server:
 
     def handle_loop (self):
         """
-        This callback will be executed at the top of each event manager loop.
+        This callback will be executed once every loop interval.
 
         @return (list) A list of modified clients (or an empty list).
         """
@@ -329,7 +503,20 @@ class Server:
 
             return
 
+        if code == signal.SIGUSR2:
+            # forking within a signal handler is asking for trouble, so the loop check takes care of this
+            if self._is_parent:
+                self._is_reexec_requested = True
+
+            return
+
         if self._is_parent:
+            if code == signal.SIGHUP and len(self._workers) > 0:
+                # replace the workers a batch at a time (the loop check takes care of this as well)
+                self._is_restart_requested = True
+
+                return
+
             # no matter what, if we're the parent we want all worker processes to shutdown, either permanently
             # or for a restart
             self.restart()
@@ -352,26 +539,26 @@ class Server:
 
     def handle_timeout_check (self):
         """
-        Loop through all active clients and find any that may be idle or have timed out.
+        Find all active clients that have been idle too long.
+
+        @return (list) A list of timed out clients that are still going to be processed.
         """
 
-        clients      = []
-        now          = time()
-        minimum_time = now - self._timeout
+        clients = []
+        now     = time()
+        wheel   = self._timeout_wheel
 
-        # iterate all clients and find the ones that are timed out/idle
+        # only the clients whose deadline has passed are visited, the rest of the clients are never touched
         # execute the timeout callback and determine what to do
-        for client in filter(lambda x: x._last_access_time < minimum_time and not x._is_channel and not x._is_host,
-                             self._clients.values()):
-
+        for client in wheel.expire(now):
             if not client.handle_timeout(self._timeout):
                 # handle timeout callback cleared events--so, we'll forcefully unregister the client
                 self.unregister_client(client)
 
                 continue
 
-            # update the client time
-            client._last_access_time = now
+            # restart the client deadline
+            wheel.add(client, now)
 
             # client is good and they're being appended to a list that will all have their fileno's updated in the
             # event manager with their new events
@@ -389,8 +576,17 @@ class Server:
         @param status (int) The exit status.
         """
 
-        if pid in self._workers:
-            self._workers.remove(pid)
+        if pid not in self._workers:
+            # a parent process started by reexec() is a child of this process as well
+            return
+
+        self._workers.remove(pid)
+
+        if pid in self._worker_slots:
+            del self._worker_slots[pid]
+
+        if pid in self._worker_ready_fds:
+            os.close(self._worker_ready_fds.pop(pid))
 
         if pid in self._channels:
             for channel in self._channels[pid]:
@@ -398,6 +594,22 @@ class Server:
 
             del self._channels[pid]
 
+        if pid in self._retiring_workers:
+            # the worker has been replaced by a rolling restart
+            self._retiring_workers.remove(pid)
+
+            return
+
+        if pid in self._restart_replacements:
+            # the new code is broken, so leave the remaining workers alone
+            del self._restart_replacements[pid]
+
+            self._restart_queue = []
+
+            print "Worker %d exited before it was ready, so the rolling restart has been stopped" % pid
+
+            return
+
         if not self._is_shutting_down:
             self.spawn_worker()
 
@@ -432,7 +644,68 @@ class Server:
         @param client (Client) The client.
         """
 
-        self._event_manager.modify(client._fileno, client._events)
+        self._event_manager_modify(client._fileno, client._events)
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def reexec (self):
+        """
+        Start a new parent process that runs the current program from scratch, so new code is loaded. The host
+        listeners are handed to it, so no connections are refused in the meantime. Once the new parent and its workers
+        are ready, the workers of this process finish their clients and this process exits.
+        """
+
+        if not self._is_parent or self._reexec_pid:
+            return
+
+        if self._chroot:
+            raise ServerException("Cannot re-execute, because the process has been chrooted")
+
+        # the listeners are listed in the order add_host() opens them
+        listeners = []
+
+        for i, first in enumerate(self._hosts):
+            for host in [first] + [hosts[i] for hosts in self._worker_hosts[1:]]:
+                listeners.append("%s:%d:%d" % (host._client_address[0], host._client_address[1], host._fileno))
+
+        read_fd, write_fd = os.pipe()
+
+        pid = os.fork()
+
+        if pid:
+            os.close(write_fd)
+
+            self._reexec_pid           = pid
+            self._worker_ready_fds[pid] = read_fd
+
+            self.call_later(0.1, self.__check_reexec)
+
+            return
+
+        try:
+            env = dict(os.environ)
+
+            env[LISTENERS_ENV] = " ".join(listeners)
+            env[READY_FD_ENV]  = str(write_fd)
+
+            # close everything other than stdio, the listeners and the pipe
+            fileno = 3
+
+            for keep in sorted([int(listener.rsplit(":", 1)[1]) for listener in listeners] + [write_fd]):
+                os.closerange(fileno, keep)
+
+                fileno = keep + 1
+
+            try:
+                os.closerange(fileno, os.sysconf("SC_OPEN_MAX"))
+
+            except (AttributeError, ValueError, OSError):
+                pass
+
+            os.execve(sys.executable, [sys.executable] + sys.argv, env)
+
+        finally:
+            os._exit(1)
 
     # ------------------------------------------------------------------------------------------------------------------
 
@@ -445,6 +718,9 @@ class Server:
 
         self._clients[client._fileno] = client
 
+        if self._timeout_wheel is not None and not client._is_channel and not client._is_host:
+            self._timeout_wheel.add(client, time())
+
         if not client._is_blocking:
             self._event_manager.register(client._fileno, client._events)
 
@@ -456,6 +732,37 @@ class Server:
 
     # ------------------------------------------------------------------------------------------------------------------
 
+    def release_accepts (self, count):
+        """
+        Give back connections that a host reserved but didn't accept, so the other hosts can accept them during the
+        current loop iteration.
+
+        @param count (int) The number of connections.
+        """
+
+        if self._accept_limit:
+            self._accept_budget += count
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def reserve_accepts (self):
+        """
+        Reserve the connections that a host can accept when it wakes up. This is the accept batch size, limited by the
+        connections that can still be accepted during the current loop iteration.
+
+        @return (int) The number of connections.
+        """
+
+        if not self._accept_limit:
+            return self._accept_batch
+
+        count                = min(self._accept_batch, self._accept_budget)
+        self._accept_budget -= count
+
+        return count
+
+    # ------------------------------------------------------------------------------------------------------------------
+
     def restart (self):
         """
         Send a restart request to all worker processes.
@@ -468,6 +775,29 @@ class Server:
 
     # ------------------------------------------------------------------------------------------------------------------
 
+    def rolling_restart (self):
+        """
+        Replace the worker processes a batch at a time. Each replacement takes the slot of the worker it replaces, and
+        that worker is only asked to finish its clients and exit once the replacement has called handle_init() and is
+        listening, so the server never runs short of workers.
+
+        Note: Workers are forked from this process, so only code that is loaded by handle_init() is reloaded. Use
+              reexec() to reload everything.
+        """
+
+        if not self._is_parent:
+            return
+
+        is_running = self._restart_queue or self._restart_replacements
+
+        self._restart_queue = [pid for pid in self._workers
+                               if pid not in self._retiring_workers and pid not in self._restart_replacements]
+
+        if not is_running:
+            self.call_later(0, self.__check_restart)
+
+    # ------------------------------------------------------------------------------------------------------------------
+
     def shutdown (self):
         """
         Unregister all clients and kill worker processes.
@@ -490,6 +820,14 @@ class Server:
         if not self._is_parent:
             return
 
+        if self._reexec_pid:
+            # the parent started by reexec() never became ready, so it must not outlive this process
+            try:
+                os.kill(self._reexec_pid, signal.SIGINT)
+
+            except:
+                pass
+
         # wait for all worker processes to exit
         for pid in self._workers:
             try:
@@ -503,9 +841,14 @@ class Server:
 
     # ------------------------------------------------------------------------------------------------------------------
 
-    def spawn_worker (self):
+    def spawn_worker (self, slot=None):
         """
         Spawn a worker process.
+
+        @param slot (int) The worker slot, which decides the listeners and cpu of the worker. If this is None, the
+                          lowest free slot is used.
+
+        @return (int) The worker process id.
         """
 
         if not self._is_parent:
@@ -528,28 +871,81 @@ class Server:
             parent_sockets.append(pair[0])
             worker_sockets.append(pair[1])
 
+        if slot is None:
+            # take the lowest free worker slot
+            slot = 0
+
+            while slot in self._worker_slots.itervalues():
+                slot += 1
+
+        # the worker reports on this pipe once it's ready
+        read_fd, write_fd = os.pipe()
+
         pid = os.fork()
 
         if pid:
+            os.close(write_fd)
+
             # initialize and register worker channels
+            self._worker_ready_fds[pid] = read_fd
+            self._worker_slots[pid]     = slot
             self._workers.append(pid)
             self.__register_channels(self.handle_channels(pid, parent_sockets))
 
-            return
+            return pid
 
         # initialization from worker perspective
         try:
-            self._channels     = {}
-            self._clients      = {}
-            self._is_listening = False
-            self._is_parent    = False
+            self._channels           = {}
+            self._clients            = {}
+            self._is_listening       = False
+            self._is_parent          = False
+            self._timer_cancel_count = 0
+            self._timers             = []
+
+            if self._is_reuse_port and slot < len(self._worker_hosts):
+                # listen on the hosts of this worker slot only, and close the listeners of the other slots so their
+                # connections are not held open by this process
+                for i, hosts in enumerate(self._worker_hosts):
+                    if i != slot:
+                        for host in hosts:
+                            host._client_socket.close()
+
+                self._hosts = self._worker_hosts[slot]
+
+            if self._is_pinned:
+                cpu.set_affinity((self._worker_cpus[slot % len(self._worker_cpus)],))
+
+            os.close(read_fd)
+
+            for fd in self._worker_ready_fds.itervalues():
+                os.close(fd)
+
+            if self._ready_fd is not None:
+                # this belongs to the parent
+                os.close(self._ready_fd)
+
+            # stagger the limits (the random state is a copy of the one in the parent, so a fresh one is needed)
+            jitter = random.Random().uniform(1 - self._limit_jitter, 1)
+
+            self._max_age          = self._max_age * jitter
+            self._max_requests     = int(math.ceil(self._max_requests * jitter))
+            self._max_rss          = int(math.ceil(self._max_rss * jitter))
+            self._ready_fd         = write_fd
+            self._request_count    = 0
+            self._start_time       = time()
+            self._worker_cpus      = []
+            self._worker_hosts     = []
+            self._worker_ready_fds = {}
+            self._worker_slots     = {}
+
+            if self._timeout_wheel is not None:
+                self._timeout_wheel = TimingWheel(self._timeout, self._timeout_interval)
+
+            self._edge_pending = set()
 
             # initialize the event manager
-            self._event_manager            = self._event_manager.__class__(self)
-            self._event_manager_modify     = self._event_manager.modify
-            self._event_manager_poll       = self._event_manager.poll
-            self._event_manager_register   = self._event_manager.register
-            self._event_manager_unregister = self._event_manager.unregister
+            self.__init_event_manager(self._event_manager.__class__)
 
             # initialize and register parent channels
             self.__register_channels(self.handle_channels(os.getpid(), worker_sockets))
@@ -584,6 +980,14 @@ class Server:
 
                 print "| Daemonized:          %-40s |" % self._is_daemon
                 print "| Event manager:       %-40s |" % self._event_manager.__class__.__name__
+                print "| Edge-triggered:      %-40s |" % self._is_edge_triggered
+                print "| Pin workers:         %-40s |" % self._is_pinned
+                print "| Reuse port:          %-40s |" % self._is_reuse_port
+                print "| Max requests:        %-40s |" % (self._max_requests if self._max_requests else "-")
+                print "| Max RSS:             %-40s |" % (self._max_rss if self._max_rss else "-")
+                print "| Max age:             %-40s |" % (self._max_age if self._max_age else "-")
+                print "| Accept batch:        %-40d |" % self._accept_batch
+                print "| Accept limit:        %-40s |" % (self._accept_limit if self._accept_limit else "-")
                 print "| Workers:             %-40d |" % self._worker_count
                 print "| Channels per worker: %-40d |" % self._channel_count
                 print "| User:                %-40s |" % (self._user if self._user else "-")
@@ -608,25 +1012,37 @@ class Server:
             for i in xrange(0, self._worker_count):
                 self.spawn_worker()
 
+            if self._is_pinned and len(self._worker_cpus) > self._worker_count:
+                # keep the parent off the worker cpus
+                cpu.set_affinity(self._worker_cpus[self._worker_count:])
+
             # if there are no workers, we need to force the process to listen on all hosts, otherwise no external clients
             # will be accepted
             if self._worker_count == 0:
                 self.listen(True)
 
+            # close the inherited listeners that no host has claimed
+            for fds in self._inherited_hosts.itervalues():
+                for fd in fds:
+                    os.close(fd)
+
+            self._inherited_hosts = {}
+
         EVENT_ERROR = self._event_manager.EVENT_ERROR
         EVENT_READ  = self._event_manager.EVENT_READ
         EVENT_WRITE = self._event_manager.EVENT_WRITE
 
         # we cache some methods/vars locally to avoid dereferencing in each loop which could potentially be
         # thousands of times per second
+        accept_limit           = self._accept_limit
         clients                = self._clients
-        is_graceful_shutdown   = self._is_graceful_shutdown
-        is_shutting_down       = self._is_shutting_down
-        loop_check             = 0
+        edge_pending           = self._edge_pending
+        is_edge_triggered      = self._is_edge_triggered
         modify_func            = self._event_manager_modify
         poll_func              = self._event_manager_poll
+        run_timers_func        = self.__run_timers
         shutdown_check         = 0
-        timeout_check          = 0
+        touch_func             = self._timeout_wheel.touch if self._timeout_wheel is not None else None
         unregister_func        = self._event_manager_unregister
         unregister_client_func = self.unregister_client
 
@@ -634,18 +1050,41 @@ class Server:
             # post start initialization
             self.handle_init()
 
-        # loop until the server is going to shutdown
-        while not is_shutting_down or is_graceful_shutdown:
-            now = time()
+            if self._ready_fd is not None:
+                self.__notify_ready()
+
+        elif self._ready_fd is not None:
+            # this process was started by reexec(), which is waiting for the workers to be ready
+            self.call_later(0, self.__check_ready)
+
+        # schedule the periodic callbacks (each one reschedules itself and is due immediately for its first run)
+        if self._is_parent and self._worker_count > 0:
+            self.call_later(0, self.__check_workers)
 
+        if self._timeout:
+            self.call_later(0, self.__check_timeouts)
+
+        if not self._is_parent and (self._max_age or self._max_rss):
+            self.call_later(1, self.__check_limits)
+
+        self.call_later(0, self.__check_loop)
+
+        # loop until the server is going to shutdown
+        while True:
             try:
-                if now - 1 > shutdown_check:
-                    # check shutdown status and for exiting worker processes
-                    is_graceful_shutdown = self._is_graceful_shutdown
-                    is_shutting_down     = self._is_shutting_down
-                    shutdown_check       = now
+                # execute all due timers and find out how long we can block before the next one is due
+                poll_timeout = run_timers_func()
+
+                if self._is_shutting_down:
+                    if not self._is_graceful_shutdown:
+                        break
+
+                    now = time()
+
+                    if now - 1 > shutdown_check:
+                        # check shutdown status
+                        shutdown_check = now
 
-                    if is_shutting_down:
                         if self._is_listening:
                             self.listen(False)
 
@@ -657,52 +1096,27 @@ class Server:
                             # we have no regular clients connected so we can shutdown
                             break
 
-                    while self._is_parent and len(self._workers) > 0:
-                        # check for exiting child processes
-                        pid, status = os.waitpid(0, os.WNOHANG)
-
-                        if not pid:
-                            break
-
-                        try:
-                            self.handle_worker_exited(pid, status)
-
-                        except Exception, e:
-                            # an unhandled exception has been caught
-                            self.handle_exception(e)
-
-                    # execute a timeout callback at most every [timeout interval] seconds
-                    if self._timeout and now - self._timeout_interval > timeout_check:
-                        try:
-                            timeout_check = now
+                    # keep checking the shutdown status at least once per second
+                    if poll_timeout is None or poll_timeout > 1:
+                        poll_timeout = 1
 
-                            # update the events for any clients that have timed out and are still going to be processed
-                            for client in self.handle_timeout_check():
-                                modify_func(client._fileno, client._events)
+                if edge_pending:
+                    # clients have work left over from the previous pass, so we cannot block
+                    ready = poll_func(0)
 
-                        except Exception, e:
-                            # an unhandled exception has been caught
-                            self.handle_exception(e)
+                    ready.extend([(fileno, 0) for fileno in edge_pending if fileno in clients])
+                    edge_pending.clear()
 
-                            continue
-
-                    # execute a loop callback at most once per second
-                    if now - self._loop_interval > loop_check:
-                        try:
-                            loop_check = now
-
-                            # update the events for any clients that were changed during the loop handler
-                            for client in self.handle_loop():
-                                modify_func(client._fileno, client._events)
+                else:
+                    ready = poll_func(poll_timeout)
 
-                        except Exception, e:
-                            # an unhandled exception has been caught
-                            self.handle_exception(e)
+                if accept_limit:
+                    self._accept_budget = accept_limit
 
-                            continue
+                now = time()
 
                 # iterate over all clients that have an active event
-                for fileno, events in poll_func():
+                for fileno, events in ready:
                     try:
                         client = clients[fileno]
 
@@ -723,25 +1137,60 @@ class Server:
 
                         continue
 
-                    if events & EVENT_READ:
-                        client.handle_read()
+                    if is_edge_triggered:
+                        client._ready_events |= events
+
+                        # keep handling the client until it no longer wants anything the socket is ready for (a read
+                        # often produces a response that can be written right away), but give up after a few rounds
+                        # so other clients get their turn
+                        for i in xrange(16):
+                            events = client._ready_events & client._events
 
-                    if events & EVENT_WRITE:
-                        client.handle_write()
+                            if events & EVENT_READ:
+                                client.handle_read()
+
+                                events = client._ready_events & client._events
+
+                            if events & EVENT_WRITE:
+                                client.handle_write()
+
+                            elif not events & EVENT_READ:
+                                break
+
+                        else:
+                            edge_pending.add(fileno)
 
-                    # check for event changes
-                    if client_events != client._events:
                         if client._events == 0:
                             # no more events for this client
                             unregister_client_func(client)
 
                             continue
 
-                        # update the events
-                        modify_func(fileno, client._events)
+                    else:
+                        if events & EVENT_READ:
+                            client.handle_read()
+
+                            # a read often produces a response, and the socket is almost always writable, so try the
+                            # write right away instead of paying for two modifications and another poll
+                            events |= client._events & EVENT_WRITE
+
+                        if events & EVENT_WRITE:
+                            client.handle_write()
 
-                    # update the client time
-                    client._last_access_time = now
+                        # check for event changes
+                        if client_events != client._events:
+                            if client._events == 0:
+                                # no more events for this client
+                                unregister_client_func(client)
+
+                                continue
+
+                            # update the events
+                            modify_func(fileno, client._events)
+
+                    # push back the client idle deadline
+                    if touch_func:
+                        touch_func(client, now)
 
             except socket.error, e:
                 if e[0] not in (errno.EWOULDBLOCK, errno.EAGAIN):
@@ -766,8 +1215,9 @@ class Server:
                     # update the events
                     modify_func(fileno, client._events)
 
-                # update the client time
-                client._last_access_time = now
+                # push back the client idle deadline
+                if touch_func:
+                    touch_func(client, now)
 
         self.shutdown()
 
@@ -797,6 +1247,9 @@ class Server:
                 except:
                     pass
 
+        if self._timeout_wheel is not None:
+            self._timeout_wheel.remove(client)
+
         try:
             self._event_manager_unregister(client._fileno)
 
@@ -820,6 +1273,12 @@ class Server:
         if host not in self._hosts:
             raise HostException("Host is not registered")
 
+        # remove the listeners that the other worker slots have on this host
+        index = self._hosts.index(host)
+
+        for hosts in self._worker_hosts:
+            hosts.pop(index)
+
         if not self._is_listening:
             self._hosts.remove(host)
 
@@ -857,6 +1316,320 @@ class Server:
 
     # ------------------------------------------------------------------------------------------------------------------
 
+    def __check_limits (self):
+        """
+        Recycle this worker once it has reached its age or memory limit, or schedule the next check. The request limit
+        is checked by count_request() as each request is counted.
+        """
+
+        if self._is_shutting_down:
+            return
+
+        age = time() - self._start_time
+        rss = self.__read_rss() if self._max_rss else 0
+
+        if self._max_age and age >= self._max_age:
+            self.__recycle("has run for %d seconds" % age)
+
+        elif self._max_rss and rss >= self._max_rss:
+            self.__recycle("has grown to %d bytes" % rss)
+
+        else:
+            self.call_later(1, self.__check_limits)
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __check_loop (self):
+        """
+        Execute the loop callback and schedule the next check.
+        """
+
+        self.call_later(self._loop_interval, self.__check_loop)
+
+        if self._is_reexec_requested:
+            self._is_reexec_requested = False
+
+            self.reexec()
+
+        if self._is_restart_requested:
+            self._is_restart_requested = False
+
+            self.rolling_restart()
+
+        # update the events for any clients that were changed during the loop handler
+        for client in self.handle_loop():
+            self._event_manager_modify(client._fileno, client._events)
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __check_ready (self):
+        """
+        Report that this process is ready once all of its workers are, or schedule the next check.
+        """
+
+        if len(filter(lambda pid: not self.__read_ready(pid), self._workers)) > 0:
+            self.call_later(0.1, self.__check_ready)
+
+            return
+
+        self.__notify_ready()
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __check_reexec (self):
+        """
+        Shutdown once the parent started by reexec() is ready, or schedule the next check.
+        """
+
+        pid    = self._reexec_pid
+        status = self.__read_ready(pid)
+
+        if status is False:
+            self.call_later(0.1, self.__check_reexec)
+
+            return
+
+        self._reexec_pid = None
+
+        if status is None:
+            os.close(self._worker_ready_fds.pop(pid))
+
+            print "Parent process %d exited before it was ready, so this process keeps running" % pid
+
+            return
+
+        # the new parent has taken over, so let the workers finish their clients and then exit
+        self._is_graceful_shutdown = True
+        self._is_shutting_down     = True
+
+        self.restart()
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __check_restart (self):
+        """
+        Retire the workers whose replacements are ready, spawn the next replacements, and schedule the next check.
+        """
+
+        if self._is_shutting_down:
+            self._restart_queue        = []
+            self._restart_replacements = {}
+
+            return
+
+        for pid, worker_pid in self._restart_replacements.items():
+            if self.__read_ready(pid):
+                # the replacement is listening, so the worker can finish its clients and exit
+                del self._restart_replacements[pid]
+
+                if worker_pid in self._workers:
+                    self._retiring_workers.add(worker_pid)
+
+                    os.kill(worker_pid, signal.SIGTERM)
+
+        while self._restart_queue and len(self._restart_replacements) < self._restart_batch:
+            worker_pid = self._restart_queue.pop(0)
+
+            if worker_pid in self._workers:
+                self._restart_replacements[self.spawn_worker(self._worker_slots.get(worker_pid))] = worker_pid
+
+        if self._restart_queue or self._restart_replacements:
+            self.call_later(0.1, self.__check_restart)
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __check_timeouts (self):
+        """
+        Execute the timeout check and schedule the next check.
+        """
+
+        self.call_later(self._timeout_interval, self.__check_timeouts)
+
+        # update the events for any clients that have timed out and are still going to be processed
+        for client in self.handle_timeout_check():
+            self._event_manager_modify(client._fileno, client._events)
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __check_workers (self):
+        """
+        Check for exiting worker processes and schedule the next check.
+        """
+
+        self.call_later(1, self.__check_workers)
+
+        while len(self._workers) > 0:
+            pid, status = os.waitpid(0, os.WNOHANG)
+
+            if not pid:
+                break
+
+            try:
+                self.handle_worker_exited(pid, status)
+
+            except Exception, e:
+                # an unhandled exception has been caught
+                self.handle_exception(e)
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __init_event_manager (self, event_manager):
+        """
+        Initialize the event manager and cache its methods.
+
+        @param event_manager (class) The event manager class.
+        """
+
+        if self._is_edge_triggered:
+            self._event_manager        = event_manager(self, edge_triggered=True)
+            self._event_manager_modify = self.__modify_edge_triggered
+
+        else:
+            self._event_manager        = event_manager(self)
+            self._event_manager_modify = self._event_manager.modify
+
+        self._event_manager_poll       = self._event_manager.poll
+        self._event_manager_register   = self._event_manager.register
+        self._event_manager_unregister = self._event_manager.unregister
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __modify_edge_triggered (self, fileno, events):
+        """
+        Queue a client for another pass of the event loop. In edge-triggered mode the kernel will not report readiness
+        that has already been reported, so a client whose events changed outside of its own event handling must be
+        revisited by the loop itself.
+
+        @param fileno (int) The file descriptor.
+        @param events (int) The events.
+        """
+
+        self._edge_pending.add(fileno)
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __notify_ready (self):
+        """
+        Report to the process that is waiting for this one that it's ready.
+        """
+
+        try:
+            os.write(self._ready_fd, ".")
+
+        except OSError:
+            # the process that was waiting has gone away
+            pass
+
+        os.close(self._ready_fd)
+
+        self._ready_fd = None
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __open_host (self, ip, port):
+        """
+        Open a listener on a host, or take over the listener that reexec() handed to this process.
+
+        @param ip   (str) A hostname or ip address.
+        @param port (int) The port.
+
+        @return (HostClient) The HostClient instance.
+        """
+
+        fds = self._inherited_hosts.get((ip, port))
+
+        if fds:
+            fd   = fds.pop(0)
+            host = socket.fromfd(fd, socket.AF_INET, socket.SOCK_STREAM)
+
+            os.close(fd)
+
+            # disable blocking
+            host.setblocking(0)
+
+            return HostClient(host, (ip, port), self)
+
+        host = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+        # disable blocking
+        host.setblocking(0)
+
+        host.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+        if self._is_reuse_port:
+            host.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+        host.bind((ip, port))
+        host.listen(socket.SOMAXCONN)
+
+        return HostClient(host, (ip, port), self)
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __read_ready (self, pid):
+        """
+        Check if a child process has reported that it's ready.
+
+        @param pid (int) The process id.
+
+        @return (bool) True, if the process is ready, False if it's not ready yet, or None if it exited before it was
+                       ready.
+        """
+
+        fd = self._worker_ready_fds.get(pid)
+
+        if fd is None:
+            # the process reported earlier
+            return True
+
+        if not select.select([fd], [], [], 0)[0]:
+            return False
+
+        if not os.read(fd, 1):
+            return None
+
+        os.close(fd)
+
+        del self._worker_ready_fds[pid]
+
+        return True
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __read_rss (self):
+        """
+        Retrieve the resident memory size of this process.
+
+        @return (int) The size in bytes. Where /proc isn't available, the peak size is used.
+        """
+
+        try:
+            return int(open("/proc/self/statm").read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+        except (IOError, IndexError, ValueError, OSError):
+            import resource
+
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+            # linux reports kilobytes, os x reports bytes
+            return rss if sys.platform == "darwin" else rss * 1024
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __recycle (self, reason):
+        """
+        Recycle this worker. It stops accepting and lets its clients finish, after which the parent spawns a new worker.
+
+        @param reason (str) The limit that has been reached.
+        """
+
+        print "Worker %d %s, so it's being recycled" % (os.getpid(), reason)
+
+        self._is_graceful_shutdown = True
+        self._is_shutting_down     = True
+
+    # ------------------------------------------------------------------------------------------------------------------
+
     def __register_channels (self, channels):
         """
         Register worker channels.
@@ -888,3 +1661,48 @@ class Server:
 
             else:
                 self._channels[channel._pid] = [channel]
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __run_timers (self):
+        """
+        Execute all timers that are due.
+
+        @return (float) The number of seconds until the next timer is due, or None if no timers are scheduled.
+        """
+
+        timers   = self._timers
+        now      = time()
+        executed = False
+
+        while timers:
+            when, sequence, timer = timers[0]
+
+            if timer._is_cancelled:
+                # lazily remove cancelled timers
+                heapq.heappop(timers)
+
+                self._timer_cancel_count -= 1
+
+                continue
+
+            if when > now:
+                if executed:
+                    # callbacks take time, so the next due time must be measured against a fresh clock
+                    return max(0, when - time())
+
+                return when - now
+
+            heapq.heappop(timers)
+
+            executed           = True
+            timer._is_executed = True
+
+            try:
+                timer._callback(*timer._args)
+
+            except Exception, e:
+                # an unhandled exception has been caught
+                self.handle_exception(e)
+
+        return None
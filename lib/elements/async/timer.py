@@ -0,0 +1,219 @@
+# This file is part of Elements.
+# Copyright (c) 2010 Sean Kerr. All rights reserved.
+#
+# The full license is available in the LICENSE file that was distributed with this source code.
+#
+# Author: Sean Kerr <sean@code-box.org>
+
+import time
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+class Timer:
+
+    def __init__ (self, when, callback, args):
+        """
+        Create a new Timer instance.
+
+        @param when     (float)  The absolute time at which the callback will be executed.
+        @param callback (method) The callback to execute.
+        @param args     (tuple)  The callback arguments.
+        """
+
+        self._args         = args     # callback arguments
+        self._callback     = callback # callback to execute when the timer is due
+        self._is_cancelled = False    # indicates that this timer has been cancelled
+        self._is_executed  = False    # indicates that this timer has been executed
+        self._when         = when     # absolute time at which this timer is due
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def is_cancelled (self):
+        """
+        Retrieve the cancellation status.
+
+        @return (bool) True, if this timer has been cancelled, otherwise False.
+        """
+
+        return self._is_cancelled
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def is_executed (self):
+        """
+        Retrieve the execution status.
+
+        @return (bool) True, if the callback has been executed, otherwise False.
+        """
+
+        return self._is_executed
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def when (self):
+        """
+        Retrieve the absolute time at which this timer is due.
+
+        @return (float) The due time.
+        """
+
+        return self._when
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+class TimingWheel:
+
+    def __init__ (self, timeout, resolution):
+        """
+        Create a new TimingWheel instance.
+
+        Clients are kept in buckets keyed by the interval in which their idle deadline falls, and are moved between
+        buckets as they see activity. Expiring clients only has to visit the buckets whose interval has fully passed,
+        so the cost of a timeout check is proportional to the number of idle clients rather than to the number of
+        connected clients. Activity within the same interval is a no-op apart from the index comparison.
+
+        Memory overhead is one set entry plus one integer attribute per client (roughly 50-70 bytes on a 64-bit
+        CPython), and one set per non-empty bucket. There are at most (timeout / resolution) + 2 live buckets.
+
+        @param timeout    (int/float) The client idle timeout.
+        @param resolution (int/float) The bucket width in seconds. A client will expire between timeout and
+                                      timeout + resolution seconds after its last activity.
+        """
+
+        self._buckets    = {}                                # bucket index -> set of clients
+        self._next_index = int(time.time() / resolution)     # lowest bucket index that has not expired yet
+        self._resolution = float(resolution)                 # bucket width in seconds
+        self._size       = 0                                 # count of tracked clients
+        self._timeout    = timeout                           # client idle timeout
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __len__ (self):
+        """
+        Retrieve the count of tracked clients.
+
+        @return (int) The count of tracked clients.
+        """
+
+        return self._size
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def add (self, client, now):
+        """
+        Start tracking a client.
+
+        @param client (Client) The client.
+        @param now    (float)  The current time.
+        """
+
+        if client._timeout_index is not None:
+            self.touch(client, now)
+
+            return
+
+        index = int((now + self._timeout) / self._resolution)
+
+        try:
+            self._buckets[index].add(client)
+
+        except KeyError:
+            self._buckets[index] = set((client,))
+
+        client._last_access_time = now
+        client._timeout_index    = index
+        self._size              += 1
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def expire (self, now):
+        """
+        Remove and return all clients whose idle deadline has passed.
+
+        @param now (float) The current time.
+
+        @return (list) The expired clients.
+        """
+
+        buckets = self._buckets
+        clients = []
+        current = int(now / self._resolution)
+
+        if current - self._next_index > len(buckets):
+            # we've been away for a long time, so it's cheaper to walk the buckets than the indices
+            indices = [index for index in buckets.keys() if index < current]
+
+        else:
+            indices = xrange(self._next_index, current)
+
+        for index in indices:
+            bucket = buckets.pop(index, None)
+
+            if bucket:
+                for client in bucket:
+                    client._timeout_index = None
+
+                clients.extend(bucket)
+
+        self._next_index  = max(self._next_index, current)
+        self._size       -= len(clients)
+
+        return clients
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def remove (self, client):
+        """
+        Stop tracking a client.
+
+        @param client (Client) The client.
+        """
+
+        index = client._timeout_index
+
+        if index is None:
+            return
+
+        bucket = self._buckets[index]
+
+        bucket.discard(client)
+
+        if not bucket:
+            del self._buckets[index]
+
+        client._timeout_index  = None
+        self._size            -= 1
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def touch (self, client, now):
+        """
+        Record activity for a tracked client. Untracked clients are ignored.
+
+        @param client (Client) The client.
+        @param now    (float)  The current time.
+        """
+
+        client._last_access_time = now
+
+        index     = int((now + self._timeout) / self._resolution)
+        old_index = client._timeout_index
+
+        if index == old_index or old_index is None:
+            return
+
+        buckets = self._buckets
+        bucket  = buckets[old_index]
+
+        bucket.discard(client)
+
+        if not bucket:
+            del buckets[old_index]
+
+        try:
+            buckets[index].add(client)
+
+        except KeyError:
+            buckets[index] = set((client,))
+
+        client._timeout_index = index
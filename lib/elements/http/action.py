@@ -16,15 +16,18 @@ from elements.model import database
 
 class HttpAction:
 
-    def __init__ (self, server, title="Method Not Allowed", response_code=response_code.HTTP_405):
+    def __init__ (self, server, title="Method Not Allowed", response_code=response_code.HTTP_405, compress=None):
         """
         Create a new HttpAction instance.
 
         @param server        (HttpServer) The HttpServer instance.
         @param title         (str)        The title to display when this core action handles a request.
         @param response_code (str)        The response code to use when this core action handles a request.
+        @param compress      (bool)       Indicates that responses may be compressed. If this is None, the
+                                          http_compress setting is used.
         """
 
+        self._compress       = compress
         self._server         = server
         self.__response_code = response_code
         self.__title         = title
@@ -37,6 +40,23 @@ class HttpAction:
 
     # ------------------------------------------------------------------------------------------------------------------
 
+    def body_sink (self, client):
+        """
+        Choose the sink that the request content is passed to as it arrives, when it isn't form data.
+
+        This is executed once the request headers have been parsed, before the request is dispatched. On a secure route
+        the client has already passed check_auth() and check_credentials(), which only run once per request, and a
+        client that fails them is answered right away, and its connection closed, without its content being read.
+
+        @param client (HttpClient) The HttpClient instance.
+
+        @return (UploadSink) The sink, or None to spool the content in memory or to a temp file.
+        """
+
+        return None
+
+    # ------------------------------------------------------------------------------------------------------------------
+
     def connect (self, client):
         """
         Handle a CONNECT request.
@@ -47,8 +67,7 @@ class HttpAction:
         client.response_code = self.__response_code
 
         client.compose_headers()
-        client.write("<html><head><title>%s</title></head><body><h1>%s</h1></body></html>" % \
-                     (self.__title, self.__title))
+        client.write(self.render_page())
 
     # ------------------------------------------------------------------------------------------------------------------
 
@@ -62,8 +81,7 @@ class HttpAction:
         client.response_code = self.__response_code
 
         client.compose_headers()
-        client.write("<html><head><title>%s</title></head><body><h1>%s</h1></body></html>" % \
-                     (self.__title, self.__title))
+        client.write(self.render_page())
 
     # ------------------------------------------------------------------------------------------------------------------
 
@@ -77,8 +95,7 @@ class HttpAction:
         client.response_code = self.__response_code
 
         client.compose_headers()
-        client.write("<html><head><title>%s</title></head><body><h1>%s</h1></body></html>" % \
-                     (self.__title, self.__title))
+        client.write(self.render_page())
 
     # ------------------------------------------------------------------------------------------------------------------
 
@@ -92,8 +109,7 @@ class HttpAction:
         client.response_code = self.__response_code
 
         client.compose_headers()
-        client.write("<html><head><title>%s</title></head><body><h1>%s</h1></body></html>" % \
-                     (self.__title, self.__title))
+        client.write(self.render_page())
 
     # ------------------------------------------------------------------------------------------------------------------
 
@@ -107,8 +123,7 @@ class HttpAction:
         client.response_code = self.__response_code
 
         client.compose_headers()
-        client.write("<html><head><title>%s</title></head><body><h1>%s</h1></body></html>" % \
-                     (self.__title, self.__title))
+        client.write(self.render_page())
 
     # ------------------------------------------------------------------------------------------------------------------
 
@@ -122,8 +137,7 @@ class HttpAction:
         client.response_code = self.__response_code
 
         client.compose_headers()
-        client.write("<html><head><title>%s</title></head><body><h1>%s</h1></body></html>" % \
-                     (self.__title, self.__title))
+        client.write(self.render_page())
 
     # ------------------------------------------------------------------------------------------------------------------
 
@@ -137,8 +151,18 @@ class HttpAction:
         client.response_code = self.__response_code
 
         client.compose_headers()
-        client.write("<html><head><title>%s</title></head><body><h1>%s</h1></body></html>" % \
-                     (self.__title, self.__title))
+        client.write(self.render_page())
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def render_page (self):
+        """
+        Render the page to display when this core action handles a request.
+
+        @return (str) The page.
+        """
+
+        return "<html><head><title>%s</title></head><body><h1>%s</h1></body></html>" % (self.__title, self.__title)
 
     # ------------------------------------------------------------------------------------------------------------------
 
@@ -152,8 +176,27 @@ class HttpAction:
         client.response_code = self.__response_code
 
         client.compose_headers()
-        client.write("<html><head><title>%s</title></head><body><h1>%s</h1></body></html>" % \
-                     (self.__title, self.__title))
+        client.write(self.render_page())
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def upload_sink (self, client, name, file):
+        """
+        Choose the sink that an upload file is passed to as it arrives.
+
+        This is executed while the request content is being received, before the request is dispatched. On a secure
+        route the client has already passed check_auth() and check_credentials(), which only run once per request, and
+        a client that fails them is answered right away, and its connection closed, without the rest of its content
+        being read.
+
+        @param client (HttpClient) The HttpClient instance.
+        @param name   (unicode)    The upload field name.
+        @param file   (dict)       The dict of upload details.
+
+        @return (UploadSink) The sink, or None to write the upload to a temp file.
+        """
+
+        return None
 
 # ----------------------------------------------------------------------------------------------------------------------
 
@@ -192,18 +235,22 @@ class SecureHttpAction (HttpAction):
 
 class StaticHttpAction (HttpAction):
 
-    def __init__ (self, fs_root, param="file", **kwargs):
+    def __init__ (self, fs_root, param="file", attachment=True, cache=None, **kwargs):
         """
         Create a new StaticHttpAction instance.
 
-        @param fs_root (str) The absolute filesystem path from which all static files will be served.
-        @param param   (str) The parameter name to pull that contains the filename to serve.
+        @param fs_root    (str)             The absolute filesystem path from which all static files will be served.
+        @param param      (str)             The parameter name to pull that contains the filename to serve.
+        @param attachment (bool)            Indicates that files should be served as download attachments.
+        @param cache      (StaticFileCache) The cache that small files will be served from.
         """
 
         HttpAction.__init__(self, **kwargs)
 
-        self._fs_root = os.path.realpath(fs_root)
-        self._param   = param
+        self._attachment = attachment
+        self._cache      = cache
+        self._fs_root    = os.path.realpath(fs_root)
+        self._param      = param
 
     # ------------------------------------------------------------------------------------------------------------------
 
@@ -216,10 +263,22 @@ class StaticHttpAction (HttpAction):
 
         file = os.path.realpath("/".join((self._fs_root, client.params.get(self._param, "").strip(" /\\"))))
 
-        if not file.startswith(self._fs_root) or file == self._fs_root or not client.serve_static_file(file):
+        if not file.startswith(self._fs_root) or file == self._fs_root or \
+           not client.serve_static_file(file, attachment=self._attachment, cache=self._cache):
             # wrong location or file doesn't exist/can't be opened for reading
             client.raise_response(response_code.HTTP_404)
 
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def head (self, client):
+        """
+        Handle a HEAD request.
+
+        @param client (HttpClient) The HttpClient instance.
+        """
+
+        self.get(client)
+
 # ----------------------------------------------------------------------------------------------------------------------
 
 class TestHttpAction (HttpAction):
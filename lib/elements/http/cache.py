@@ -0,0 +1,223 @@
+# This file is part of Elements.
+# Copyright (c) 2010 Sean Kerr. All rights reserved.
+#
+# The full license is available in the LICENSE file that was distributed with this source code.
+#
+# Author: Sean Kerr <sean@code-box.org>
+
+import os
+import time
+import zlib
+
+from collections import OrderedDict
+
+# ----------------------------------------------------------------------------------------------------------------------
+# COMPRESSION
+# ----------------------------------------------------------------------------------------------------------------------
+
+COMPRESS_TYPES = ("application/javascript", "application/json", "application/x-javascript", "application/xml",
+                  "image/svg+xml", "text/")
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+class CachedFile:
+
+    def __init__ (self, path, stat, data, content_type, etag, last_modified, gzip_data=None):
+        """
+        Create a new CachedFile instance.
+
+        @param path          (str)         The absolute filesystem path to the file.
+        @param stat          (stat_result) The file status the data was read with.
+        @param data          (str)         The file contents.
+        @param content_type  (str)         The content type.
+        @param etag          (str)         The entity tag.
+        @param last_modified (str)         The Last-Modified header value.
+        @param gzip_data     (str)         The gzip compressed file contents, if they are worth sending.
+
+        The header lines of a full response (Accept-Ranges, Content-Encoding, Content-Length, Content-Type, ETag,
+        Last-Modified and Vary) are rendered once for each variant, so a hit only adds the per-request lines.
+        """
+
+        self.content_type  = content_type
+        self.data          = data
+        self.etag          = etag
+        self.gzip_data     = gzip_data
+        self.gzip_etag     = etag[:-1] + "-gzip\"" if gzip_data else None # the compressed variant has its own tag
+        self.gzip_headers  = None
+        self.last_modified = last_modified
+        self.mtime         = int(stat.st_mtime)
+        self.path          = path
+        self.size          = len(data)
+
+        # pre-render the header lines of a full response, which only depend on the file
+        vary = "Vary: Accept-Encoding\r\n" if gzip_data else ""
+
+        self.headers = "Accept-Ranges: bytes\r\nContent-Length: %d\r\nContent-Type: %s\r\nETag: %s\r\n" \
+                       "Last-Modified: %s\r\n%s" % (self.size, content_type, etag, last_modified, vary)
+
+        if gzip_data:
+            self.gzip_headers = "Accept-Ranges: bytes\r\nContent-Encoding: gzip\r\nContent-Length: %d\r\n" \
+                                "Content-Type: %s\r\nETag: %s\r\nLast-Modified: %s\r\n%s" % \
+                                (len(gzip_data), content_type, self.gzip_etag, last_modified, vary)
+
+        self._checked      = time.time()
+        self._identity     = (stat.st_ino, stat.st_mtime, stat.st_size)
+        self._memory       = self.size + len(gzip_data or "")
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+class StaticFileCache:
+
+    def __init__ (self, max_size=16777216, max_file_size=262144, check_interval=1, compress=True):
+        """
+        Create a new StaticFileCache instance.
+
+        This is a least recently used cache of small static files, so hot assets can be served from memory without
+        opening or reading them. A cached file is checked with stat() at most once per check interval, and it is
+        dropped as soon as its inode, modification time or size changes.
+
+        @param max_size       (int)   The maximum number of bytes to hold, including compressed variants.
+        @param max_file_size  (int)   The size of the largest file that will be cached.
+        @param check_interval (float) The number of seconds between stat() checks of a cached file. Use 0 to check it
+                                      on every request.
+        @param compress       (bool)  Indicates that a gzip variant of compressible files should be kept.
+        """
+
+        self.evictions       = 0
+        self.hits            = 0
+        self.max_file_size   = max_file_size
+        self.misses          = 0
+
+        self._check_interval = check_interval
+        self._compress       = compress
+        self._files          = OrderedDict()
+        self._max_size       = max_size
+        self._size           = 0
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def add (self, path, stat, data, content_type, etag, last_modified):
+        """
+        Cache a file.
+
+        @param path          (str)         The absolute filesystem path to the file.
+        @param stat          (stat_result) The file status the data was read with.
+        @param data          (str)         The file contents.
+        @param content_type  (str)         The content type.
+        @param etag          (str)         The entity tag.
+        @param last_modified (str)         The Last-Modified header value.
+
+        @return (CachedFile) The cached file, or None if the file is too large to be cached.
+        """
+
+        if len(data) > self.max_file_size or len(data) > self._max_size:
+            return None
+
+        gzip_data = None
+
+        if self._compress and data and content_type.startswith(COMPRESS_TYPES):
+            compressor = zlib.compressobj(9, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+            gzip_data  = compressor.compress(data) + compressor.flush()
+
+            if len(gzip_data) >= len(data):
+                # not worth sending
+                gzip_data = None
+
+        self.remove(path)
+
+        file = CachedFile(path, stat, data, content_type, etag, last_modified, gzip_data)
+
+        self._files[path]  = file
+        self._size        += file._memory
+
+        # evict the least recently used files
+        files = self._files
+
+        while self._size > self._max_size:
+            self._size     -= files.popitem(False)[1]._memory
+            self.evictions += 1
+
+        return file
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def clear (self):
+        """
+        Remove all cached files.
+        """
+
+        self._files.clear()
+
+        self._size = 0
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def get (self, path):
+        """
+        Retrieve a cached file.
+
+        @param path (str) The absolute filesystem path to the file.
+
+        @return (CachedFile) The cached file, or None if the file is not cached or has changed.
+        """
+
+        file = self._files.pop(path, None)
+
+        if not file:
+            self.misses += 1
+
+            return None
+
+        now = time.time()
+
+        if now - file._checked >= self._check_interval:
+            try:
+                stat = os.stat(path)
+
+                is_stale = file._identity != (stat.st_ino, stat.st_mtime, stat.st_size)
+
+            except OSError:
+                is_stale = True
+
+            if is_stale:
+                self._size  -= file._memory
+                self.misses += 1
+
+                return None
+
+            file._checked = now
+
+        # move the file to the most recently used end
+        self._files[path]  = file
+        self.hits         += 1
+
+        return file
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def remove (self, path):
+        """
+        Remove a cached file.
+
+        @param path (str) The absolute filesystem path to the file.
+        """
+
+        file = self._files.pop(path, None)
+
+        if file:
+            self._size -= file._memory
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def stats (self):
+        """
+        Retrieve the cache counters.
+
+        @return (dict) The number of files, bytes held, hits, misses and evictions.
+        """
+
+        return { "evictions": self.evictions,
+                 "files":     len(self._files),
+                 "hits":      self.hits,
+                 "misses":    self.misses,
+                 "size":      self._size }
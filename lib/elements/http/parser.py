@@ -0,0 +1,206 @@
+# This file is part of Elements.
+# Copyright (c) 2010 Sean Kerr. All rights reserved.
+#
+# The full license is available in the LICENSE file that was distributed with this source code.
+#
+# Author: Sean Kerr <sean@code-box.org>
+
+import re
+import urlparse
+
+# ----------------------------------------------------------------------------------------------------------------------
+# HEADERS
+# ----------------------------------------------------------------------------------------------------------------------
+
+COMMON_HEADERS = ("Accept", "Accept-Charset", "Accept-Encoding", "Accept-Language", "Authorization", "Cache-Control",
+                  "Connection", "Content-Length", "Content-Type", "Cookie", "DNT", "Expect", "Forwarded", "Host",
+                  "If-Match", "If-Modified-Since", "If-None-Match", "If-Range", "If-Unmodified-Since", "Keep-Alive",
+                  "Origin", "Pragma", "Range", "Referer", "Sec-CH-UA", "Sec-CH-UA-Mobile", "Sec-CH-UA-Platform",
+                  "Sec-Fetch-Dest", "Sec-Fetch-Mode", "Sec-Fetch-Site", "Sec-Fetch-User", "TE", "Transfer-Encoding",
+                  "Upgrade", "Upgrade-Insecure-Requests", "User-Agent", "Via", "X-Forwarded-For", "X-Forwarded-Host",
+                  "X-Forwarded-Proto", "X-Real-IP", "X-Requested-With")
+
+MAX_HEADER_KEYS = 1024 # maximum number of header names the lookup table will grow to
+
+# header name to in_headers key lookup table, seeded with the spellings browsers and clients actually send
+HEADER_KEYS = {}
+
+for name in COMMON_HEADERS:
+    key = intern("HTTP_" + name.upper().replace("-", "_"))
+
+    HEADER_KEYS[name]         = key
+    HEADER_KEYS[name.lower()] = key
+    HEADER_KEYS[name.title()] = key
+
+del key, name
+
+# parameters of a header value such as Content-Type or Content-Disposition, which may be quoted (browsers percent-encode
+# quotes within a value rather than escaping them)
+HEADER_PARAM_PATTERN = re.compile(r";\s*([^\s;=]+)\s*=\s*(\"[^\"]*\"|[^;]*)")
+
+# ----------------------------------------------------------------------------------------------------------------------
+# REQUEST LINE
+# ----------------------------------------------------------------------------------------------------------------------
+
+METHODS   = frozenset(("CONNECT", "DELETE", "GET", "HEAD", "OPTIONS", "POST", "PUT", "TRACE"))
+PROTOCOLS = frozenset(("HTTP/1.0", "HTTP/1.1"))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+def header_key (name):
+    """
+    Retrieve the in_headers key for a header name.
+
+    Names that are not in the lookup table are converted and added to it, until it holds MAX_HEADER_KEYS names.
+
+    @param name (str) The header name.
+
+    @return (str) The in_headers key.
+    """
+
+    key = HEADER_KEYS.get(name)
+
+    if key:
+        return key
+
+    if not name or name != name.strip():
+        # whitespace between the name and the colon is not allowed
+        raise ValueError("Invalid header name '%s'" % name)
+
+    key = "HTTP_" + name.upper().replace("-", "_")
+
+    if len(HEADER_KEYS) < MAX_HEADER_KEYS:
+        HEADER_KEYS[name] = key = intern(key)
+
+    return key
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+def parse_cookies (value):
+    """
+    Parse a Cookie header.
+
+    @param value (str) The header value.
+
+    @return (dict) The cookie values, keyed by name. Pairs without a value are skipped.
+    """
+
+    cookies = {}
+
+    for cookie in value.split(";"):
+        name, separator, cookie = cookie.partition("=")
+
+        if separator:
+            cookies[name.strip()] = cookie.strip()
+
+    return cookies
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+def parse_headers (data, headers):
+    """
+    Parse a block of headers in a single pass.
+
+    @param data    (str)  The header lines, separated by CRLF. Empty lines are skipped.
+    @param headers (dict) The dict into which the headers will be stored, using CGI style keys.
+
+    @return (dict) The headers dict.
+    """
+
+    get = HEADER_KEYS.get
+
+    for line in data.split("\r\n"):
+        if not line:
+            continue
+
+        name, separator, value = line.partition(":")
+
+        if not separator:
+            raise ValueError("Invalid header line '%s'" % line)
+
+        headers[get(name) or header_key(name)] = value.strip()
+
+    return headers
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+def parse_header_value (value):
+    """
+    Parse a header value that has parameters, such as Content-Type or Content-Disposition.
+
+    @param value (str) The header value.
+
+    @return (tuple) A two-part tuple containing the lower-cased value without its parameters, and a dict of parameters
+                    keyed by lower-cased name. Quotes around parameter values are removed.
+    """
+
+    pos    = value.find(";")
+    params = {}
+
+    if pos == -1:
+        return value.strip().lower(), params
+
+    for name, param in HEADER_PARAM_PATTERN.findall(value, pos):
+        if param.startswith("\""):
+            param = param[1:-1]
+
+        else:
+            param = param.strip()
+
+        params[name.lower()] = param
+
+    return value[:pos].strip().lower(), params
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+def parse_query_string (query_string):
+    """
+    Parse a query string or urlencoded body.
+
+    @param query_string (str) The query string.
+
+    @return (dict) The parameters, keyed by name. A parameter that appears once is stored as a str, otherwise as a
+                   list.
+    """
+
+    params = urlparse.parse_qs(query_string, True)
+
+    for key, value in params.iteritems():
+        if len(value) == 1:
+            params[key] = value[0]
+
+    return params
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+def parse_request_line (line):
+    """
+    Parse a request line.
+
+    The method and protocol are upper-cased but not verified, so the caller can choose the response to an unknown
+    method or protocol. A request line without a protocol is treated as HTTP/1.0.
+
+    @param line (str) The request line, without the trailing CRLF.
+
+    @return (tuple) A three-part tuple containing the method, uri and protocol.
+    """
+
+    parts = line.split(" ")
+
+    if len(parts) == 3:
+        method, uri, protocol = parts
+
+    elif len(parts) == 2:
+        method, uri = parts
+        protocol    = "HTTP/1.0"
+
+    else:
+        raise ValueError("Invalid request line '%s'" % line)
+
+    if method not in METHODS:
+        method = method.upper()
+
+    if protocol not in PROTOCOLS:
+        protocol = protocol.upper()
+
+    return method, uri, protocol
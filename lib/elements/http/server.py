@@ -13,6 +13,7 @@ except:
 
 import datetime
 import decimal
+import email.utils
 import mimetypes
 import os
 import random
@@ -22,6 +23,7 @@ import string
 import time
 import urllib
 import urlparse
+import zlib
 
 import settings
 
@@ -32,7 +34,17 @@ from elements.async.client   import Client
 from elements.async.server   import Server
 from elements.http.action    import HttpAction
 from elements.http.action    import SecureHttpAction
+from elements.http           import parser
 from elements.http           import response_code
+from elements.http           import upload
+
+# ----------------------------------------------------------------------------------------------------------------------
+# COMPRESSION
+# ----------------------------------------------------------------------------------------------------------------------
+
+COMPRESSED_TYPES = ("application/gzip", "application/octet-stream", "application/pdf", "application/x-gzip",
+                    "application/zip", "audio/", "font/woff", "image/gif", "image/jpeg", "image/png", "image/webp",
+                    "video/")
 
 # ----------------------------------------------------------------------------------------------------------------------
 # ERROR CODES
@@ -44,8 +56,8 @@ ERROR_UPLOAD_MAX_SIZE = 1
 # MISC SETTINGS
 # ----------------------------------------------------------------------------------------------------------------------
 
-FILE_READ_SIZE = 131070
-
+MAX_CHUNK_LENGTH_LINE  = 1024 # maximum length of a request chunk length line, including chunk extensions
+MAX_RANGES             = 32   # maximum number of disjoint byte ranges served, beyond which the whole file is served
 PERSISTENCE_KEEP_ALIVE = 1
 PERSISTENCE_PROTOCOL   = 2
 
@@ -66,23 +78,77 @@ class HttpClient (Client):
 
         Client.__init__(self, client_socket, client_address, server, server_address)
 
-        self._chunked_write_buffer    = StringIO.StringIO() # chunk encoding write buffer
+        self._body_buffer             = []                  # response body held back along with the headers
+        self._body_length             = 0                   # response body length held back
+        self._body_remaining          = 0                   # request content length that hasn't been read yet
+        self._body_sink               = None                # current request content sink
+        self._body_size               = 0                   # request content length announced so far
+        self._compressor              = None                # response body compressor
+        self._form_data               = None                # urlencoded content that hasn't been parsed into params
         self._is_allowing_persistence = False               # indicates that this client allows persistence
+        self._is_body_chunked         = False               # indicates that the request content is chunked
+        self._is_buffering            = False               # indicates that the headers and body are held back
+        self._is_finished             = False               # indicates that the response has been finished
         self._is_headers_written      = False               # indicates that the headers have been written
+        self._is_pipeline_full        = False               # indicates that reading the next request is on hold
         self._max_persistent_requests = None                # maximum persistent requests allowed
-        self._multipart_file          = None                # current multipart upload file
+        self._multipart_sink          = None                # current multipart upload sink
+        self._multipart_upload        = None                # current multipart upload details
         self._orig_read_delimiter     = self.read_delimiter # original read delimiter method
+        self._orig_read_size          = self._read_size     # original read size
         self._orig_write              = self.write          # original write method
         self._request_count           = 0                   # count of served requests (only useful if persistence is
                                                             # enabled)
+        self._static_file             = None                # file of the static file response being sent
+        self._static_headers          = None                # pre-rendered header lines of a cached static file
         self.session                  = None                # current session
 
         # files variable must exist because it's access in handle_shutdown(), and handle_shutdown() is always called,
         # even in the event that a timeout occurred before a request could physically be handled
         self.__files = []
 
-        # read until we get the initial request line
-        self.read_delimiter("\r\n", self.handle_request, settings.http_max_request_length)
+        # read until we get the request line and headers
+        self.read_delimiter("\r\n\r\n", self.handle_request,
+                            settings.http_max_request_length + settings.http_max_headers_length)
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __getattr__ (self, name):
+        """
+        Parse the cookies or parameters of the current request the first time they're accessed.
+
+        The parsed dict is stored as a regular attribute, so this is only executed once per request.
+
+        @param name (str) The attribute name.
+
+        @return (dict) The cookies or parameters.
+        """
+
+        if name == "params":
+            in_headers = self.in_headers
+
+            if "QUERY_STRING" in in_headers:
+                params = parser.parse_query_string(in_headers["QUERY_STRING"])
+
+            else:
+                params = {}
+
+            self.params = params
+
+            if self._form_data is not None:
+                self.__merge_params(self._form_data)
+
+                self._form_data = None
+
+            return params
+
+        if name == "in_cookies":
+            in_cookies      = parser.parse_cookies(self.in_headers.get("HTTP_COOKIE", ""))
+            self.in_cookies = in_cookies
+
+            return in_cookies
+
+        raise AttributeError("'%s' object has no attribute '%s'" % (self.__class__.__name__, name))
 
     # ------------------------------------------------------------------------------------------------------------------
 
@@ -99,60 +165,185 @@ class HttpClient (Client):
 
     # ------------------------------------------------------------------------------------------------------------------
 
+    def clear_response (self):
+        """
+        Discard the response, as long as none of it has been sent yet.
+
+        @return (bool) True, if another response can be composed in its place, otherwise False.
+        """
+
+        if self._is_headers_written and not self._is_buffering:
+            return False
+
+        self._body_buffer        = []
+        self._body_length        = 0
+        self._compressor         = None
+        self._is_buffering       = False
+        self._is_headers_written = False
+        self.content_type        = "text/html"
+        self.out_cookies         = {}
+        self.out_headers         = {}
+        self.response_code       = response_code.HTTP_200
+        self.write               = self._orig_write
+
+        return True
+
+    # ------------------------------------------------------------------------------------------------------------------
+
     def compose_headers (self, chunked_encoding=True):
         """
         Compose the response headers.
 
-        @param chunked_encoding (bool) Indicates that chunked encoding should be used.
+        Unless chunked encoding is disabled, the headers are held back along with the body. A body that is finished
+        within http_max_buffered_size bytes is sent with a Content-Length, and a larger body is streamed from that point
+        on, using chunked encoding when the protocol supports it.
+
+        @param chunked_encoding (bool) Indicates that chunked encoding can be used. Disable this to send the headers
+                                       right away when the body framing is handled by the caller.
         """
 
         if self._is_headers_written:
             return
 
-        chunked_encoding = chunked_encoding and self.in_headers["SERVER_PROTOCOL"] != "HTTP/1.0" and \
-                           not self._static_file
-        out_headers      = self.out_headers
-
-        # required headers
-        out_headers["Content-Type"] = self.content_type
-        out_headers["Server"]       = elements.APP_NAME
-
-        if chunked_encoding:
-            out_headers["Transfer-Encoding"] = "chunked"
-
         if self.session:
             # set session cookie
             self.set_cookie(settings.http_session_cookie, self.session.session_id)
 
-        # handle persistence
-        if self._max_persistent_requests and self._request_count >= self._max_persistent_requests:
+        self._is_headers_written = True
+
+        if chunked_encoding and not self._static_file:
+            # the response will be finished on the next write event if it isn't finished by the dispatch
+            self._events       |= self._server.EVENT_WRITE
+            self._is_buffering  = True
+            self.write          = self.__buffered_write
+
+            return
+
+        self.__write_headers()
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def handle_body_content (self, data):
+        """
+        This callback will be executed when a chunk of content has been read, and it needs passed to the body sink.
+
+        @param data (memoryview) The chunk, which is only valid until this returns.
+        """
+
+        self._body_sink.write(data)
+
+        self._body_remaining -= len(data)
+
+        if self._body_remaining:
+            # read the next chunk
+            self.read_length(min(self._body_remaining, self._read_size), self.handle_body_content, True)
+
+            return
+
+        if self._is_body_chunked:
+            # read until we consume the 2 bytes (CRLF) after the chunk
+            self.read_length(2, self.handle_body_chunk_end)
+
+            return
+
+        self.__finish_body()
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def handle_body_chunk_end (self, data):
+        """
+        This callback will be executed after each chunk of chunked request content.
+
+        @param data (str) The 2 bytes after the chunk.
+        """
+
+        if data != "\r\n":
+            # bad request
             self._persistence_type = None
 
-        elif self._is_allowing_persistence:
-            if self._persistence_type:
-                out_headers["Connection"] = "keep-alive"
+            self.raise_response(response_code.HTTP_400)
 
-            else:
-                out_headers["Connection"] = "close"
+            return
 
-        # build the request head
-        self.write(" ".join((self.in_headers["SERVER_PROTOCOL"], self.response_code)))
-        self.write("\r\n")
-        self.write("\r\n".join(["%s: %s" % header for header in out_headers.items()]))
-        self.write("\r\n")
+        # read until we get the next chunk length
+        self.read_delimiter("\r\n", self.handle_body_chunk_length, MAX_CHUNK_LENGTH_LINE)
 
-        if self.out_cookies:
-            self.write("\r\n".join(["Set-Cookie: %s" % cookie for cookie in self.out_cookies.values()]))
-            self.write("\r\n")
+    # ------------------------------------------------------------------------------------------------------------------
 
-        self.write("\r\n")
+    def handle_body_chunk_length (self, data):
+        """
+        This callback will be executed prior to each chunk of chunked request content. This determines the chunk length.
+
+        @param data (str) The chunk length line, which may contain chunk extensions.
+        """
+
+        try:
+            length = int(data[:-2].split(";", 1)[0], 16)
+
+            if length < 0:
+                raise ValueError("Negative chunk length")
+
+        except:
+            # bad request
+            self._persistence_type = None
+
+            self.raise_response(response_code.HTTP_400)
+
+            return
+
+        if not length:
+            # last chunk, read until we get the end of the trailers
+            self.read_length(2, self.handle_body_trailers)
+
+            return
 
-        if chunked_encoding:
-            # future write operations must use a chunked encoding
-            self.write = self.__chunked_write
+        self._body_size += length
 
-        self.__is_chunked_encoded = True
-        self._is_headers_written  = True
+        if settings.http_max_body_size and self._body_size > settings.http_max_body_size:
+            # the rest of the content won't be read, so the connection can't be reused
+            self._persistence_type = None
+
+            self.raise_response(response_code.HTTP_413)
+
+            return
+
+        self._body_remaining = length
+
+        # read the first part of the chunk
+        self.read_length(min(length, self._read_size), self.handle_body_content, True)
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def handle_body_sink (self):
+        """
+        This callback will be executed when the request has content that isn't form data, to choose the sink that the
+        content is passed to as it arrives. The sink is available as the body attribute during the dispatch.
+
+        By default the content is held in memory until it grows over http_body_spool_size bytes, at which point it's
+        moved to a temp file within http_upload_dir. Its file attribute is rewound once the content has been read.
+
+        @return (UploadSink) The sink.
+        """
+
+        return upload.SpoolSink(settings.http_body_spool_size, settings.http_upload_dir)
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def handle_body_trailers (self, data):
+        """
+        This callback will be executed after the last chunk of chunked request content. The trailers are discarded.
+
+        @param data (str) The 2 bytes after the last chunk, or the rest of the trailers.
+        """
+
+        if data == "\r\n" or data.endswith("\r\n\r\n"):
+            # the content has been read entirely
+            self.__finish_body()
+
+            return
+
+        # read until we get the end of the trailers
+        self.read_delimiter("\r\n\r\n", self.handle_body_trailers, settings.http_max_headers_length)
 
     # ------------------------------------------------------------------------------------------------------------------
 
@@ -161,14 +352,38 @@ class HttpClient (Client):
         This callback will be executed after the headers have been parsed and content negotiation needs to start.
         """
 
+        in_headers = self.in_headers
+
+        # check transfer encoding
+        is_chunked = "HTTP_TRANSFER_ENCODING" in in_headers
+
+        if is_chunked:
+            if in_headers["HTTP_TRANSFER_ENCODING"].lower() != "chunked":
+                # transfer coding not implemented, and the content can't be read without it
+                self._persistence_type = None
+
+                self.raise_response(response_code.HTTP_501)
+
+                return
+
+            if "HTTP_CONTENT_LENGTH" in in_headers:
+                # the content length must be ignored, and a message that sends both can't be trusted to end where the
+                # next one starts
+                self._persistence_type = None
+
         # check content type
-        content_type = self.in_headers.get("HTTP_CONTENT_TYPE", "text/plain").lower()
+        content_type = in_headers.get("HTTP_CONTENT_TYPE", "text/plain").lower()
+
+        if is_chunked and (content_type == "application/x-www-form-urlencoded" or
+                           content_type.startswith("multipart/form-data")):
+            # form data must be sent with a content length
+            self._persistence_type = None
+
+            self.raise_response(response_code.HTTP_411)
 
-        if content_type == "text/plain":
-            # nothing else to do, just dispatch the request
-            self.handle_dispatch()
+            return
 
-        elif content_type == "application/x-www-form-urlencoded":
+        if content_type == "application/x-www-form-urlencoded":
             # request contains encoded content
             try:
                 content_length = int(self.in_headers["HTTP_CONTENT_LENGTH"])
@@ -183,11 +398,86 @@ class HttpClient (Client):
             self.read_length(content_length, self.handle_urlencoded_content)
 
         elif content_type.startswith("multipart/form-data"):
-            # request contains multipart content
-            self._multipart_boundary = "--" + content_type[30:]
+            # request contains multipart content, and the boundary is case sensitive so it's taken from the original
+            # header value
+            try:
+                boundary       = parser.parse_header_value(self.in_headers["HTTP_CONTENT_TYPE"])[1]["boundary"]
+                content_length = int(self.in_headers.get("HTTP_CONTENT_LENGTH", 0))
+
+            except:
+                # bad request
+                self._persistence_type = None
+
+                self.raise_response(response_code.HTTP_400)
+
+                return
+
+            # every boundary but the first is preceded by a CRLF that belongs to it, rather than to the part before it
+            self._multipart_boundary = "\r\n--" + boundary
+
+            self.__enlarge_read_size(content_length)
+
+            # read until we have consumed the first boundary
+            self.read_length(len(self._multipart_boundary) - 2, self.handle_multipart_boundary)
+
+        else:
+            # any other content is passed to the body sink as it arrives
+            if is_chunked:
+                # the length of each chunk is read ahead of it
+                content_length = 0
+
+            else:
+                try:
+                    content_length = int(in_headers.get("HTTP_CONTENT_LENGTH", 0))
+
+                    if content_length < 0:
+                        raise ValueError("Negative content length")
+
+                except:
+                    # bad request
+                    self._persistence_type = None
+
+                    self.raise_response(response_code.HTTP_400)
+
+                    return
+
+                if not content_length:
+                    # nothing else to do, just dispatch the request
+                    self.__dispatch()
+
+                    return
+
+                if settings.http_max_body_size and content_length > settings.http_max_body_size:
+                    # the content won't be read, so the connection can't be reused
+                    self._persistence_type = None
+
+                    self.raise_response(response_code.HTTP_413)
+
+                    return
+
+            self._body_sink = self.handle_body_sink()
+
+            if self._is_headers_written:
+                # the request was refused before its content was read, so the connection can't be reused, and the
+                # unused sink is aborted when it closes
+                self._persistence_type = None
+
+                return
+
+            self._body_remaining  = content_length
+            self._body_size       = content_length
+            self._is_body_chunked = is_chunked
+            self.body             = self._body_sink
+
+            self.__enlarge_read_size(content_length)
+
+            if is_chunked:
+                # read until we get the first chunk length
+                self.read_delimiter("\r\n", self.handle_body_chunk_length, MAX_CHUNK_LENGTH_LINE)
 
-            # read until we have consumed all of the boundary details
-            self.read_length(len(self._multipart_boundary), self.handle_multipart_boundary)
+            else:
+                # read the first part of the content
+                self.read_length(min(content_length, self._read_size), self.handle_body_content, True)
 
     # ------------------------------------------------------------------------------------------------------------------
 
@@ -208,21 +498,7 @@ class HttpClient (Client):
         """
 
         try:
-            in_cookies = self.in_cookies
-            in_headers = self.in_headers
-
-            # parse headers
-            for header in data.rstrip().split("\r\n"):
-                header = header.split(": ", 1)
-
-                in_headers["HTTP_" + header[0].upper().replace("-", "_")] = header[1]
-
-            # parse cookies
-            if "HTTP_COOKIE" in in_headers:
-                for cookie in in_headers["HTTP_COOKIE"].split(";"):
-                    cookie = cookie.strip().split("=", 1)
-
-                    in_cookies[cookie[0]] = cookie[1]
+            in_headers = parser.parse_headers(data, self.in_headers)
 
             # check persistence
             if in_headers["SERVER_PROTOCOL"] == "HTTP/1.1":
@@ -267,6 +543,14 @@ class HttpClient (Client):
         @param data (str) The multipart boundary.
         """
 
+        if data != self._multipart_boundary[2:]:
+            # the content doesn't start with the boundary
+            self._persistence_type = None
+
+            self.raise_response(response_code.HTTP_400)
+
+            return
+
         # read until we have consumed the 2 bytes (CRLF) after the boundary
         self.read_length(2, self.handle_multipart_post_boundary)
 
@@ -280,57 +564,36 @@ class HttpClient (Client):
         """
 
         try:
-            # parse headers
-            headers = {}
+            headers = parser.parse_headers(data, {})
+            params  = parser.parse_header_value(headers["HTTP_CONTENT_DISPOSITION"])[1]
+            name    = params["name"].decode("utf-8")
 
-            for header in data.rstrip().split("\r\n"):
-                header = header.split(": ")
-
-                headers[header[0].upper()] = header[1]
+        except:
+            # bad request
+            self._persistence_type = None
 
-            disposition = headers["CONTENT-DISPOSITION"][11:]
-            name        = disposition[6:disposition.find("\"", 6)].decode("utf-8")
-            pos         = disposition.find("filename=\"")
+            self.raise_response(response_code.HTTP_400)
 
-            self.read_delimiter  = self.multipart_read_delimiter
-            self._multipart_name = name
+            return
 
-            if pos == -1:
-                # read until we have all of the field data
-                self.read_delimiter(self._multipart_boundary, self.handle_multipart_post_boundary, 1000)
+        self._multipart_name = name
+        self.read_delimiter  = self.multipart_read_delimiter
 
-                return
+        if "filename" not in params:
+            # read until we have all of the field data
+            self.read_delimiter(self._multipart_boundary, self.handle_multipart_post_boundary,
+                                settings.http_max_field_length)
 
-            # file upload
-            pos += 10
+            return
 
+        # file upload
+        try:
             if not self.files:
                 self.files = {}
 
-            # enlarge the read size so uploads are quicker
-            content_length = int(self.in_headers.get("HTTP_CONTENT_LENGTH", 0))
-
-            if content_length >= 1048576:
-                # content is at least a meg, use a rather large read size
-                self._orig_read_size = self._read_size
-                self._read_size      = 131070
-
-            else:
-                # content is potentially large, use a moderate read size
-                self._orig_read_size = self._read_size
-                self._read_size      = 65535
-
-            # open a temp file to store the upload
-            chars     = "".join((string.letters, string.digits))
-            temp_name = "/".join((settings.http_upload_dir, "".join([random.choice(chars) for x in xrange(0, 25)])))
-
-            file = { "error":      None,
-                     "filename":   disposition[pos:disposition.find("\"", pos)],
-                     "size":       0,
-                     "temp_name":  temp_name }
-
-            # add temp filename to list
-            self.__files.append(temp_name)
+            file = { "error":    None,
+                     "filename": params["filename"],
+                     "size":     0 }
 
             # determine mimetype
             mimetype = mimetypes.guess_type(file["filename"])
@@ -355,14 +618,26 @@ class HttpClient (Client):
                 self.files[name] = file
 
             self._is_multipart_maxed  = False
-            self._multipart_file      = open(temp_name, "wb+")
+            self._multipart_sink      = self.handle_upload_sink(name, file)
             self._multipart_file_size = 0
+            self._multipart_upload    = file
 
         except:
             # bad request
+            self._persistence_type = None
+
             self.raise_response(response_code.HTTP_400)
 
-        # read until we hit the boundary
+            return
+
+        if self._is_headers_written:
+            # the request was refused before the rest of its content was read, so the connection can't be reused, and
+            # the unused sink is aborted when it closes
+            self._persistence_type = None
+
+            return
+
+        # read until we hit the boundary, passing the upload to the sink as it arrives
         self.read_delimiter(self._multipart_boundary, self.handle_multipart_post_boundary)
 
     # ------------------------------------------------------------------------------------------------------------------
@@ -382,32 +657,54 @@ class HttpClient (Client):
 
         elif data == "--":
             # no more multipart data
-            self.handle_dispatch()
+            self._read_size = self._orig_read_size
+
+            self.__dispatch()
 
             return
 
         # bad request
+        self._persistence_type = None
+
         self.raise_response(response_code.HTTP_400)
 
     # ------------------------------------------------------------------------------------------------------------------
 
     def handle_request (self, data):
         """
-        This callback will be executed when the initial request line needs parsed.
+        This callback will be executed when the request line and headers need parsed.
 
-        @param data (str) The data that has tentatively been found as the request line.
+        @param data (str) The data that has tentatively been found as the request line and headers.
         """
 
+        # skip empty lines ahead of the request line, such as a CRLF sent after a request body
+        data = data.lstrip("\r\n")
+
+        if not data:
+            self.__read_request()
+
+            return
+
+        # the uploads of the previous request are no longer needed
+        if self.__files:
+            self.__remove_temp_files()
+
         self.__is_chunked_encoded = False
-        self.__files              = []
+        self._body_sink           = None
+        self._compressor          = None
+        self._form_data           = None
+        self._is_buffering        = False
+        self._is_finished         = False
         self._is_headers_written  = False
-        self._multipart_file      = None
+        self._multipart_sink      = None
         self._persistence_type    = None
         self._request_count      += 1
         self._static_file         = None
+        self._static_headers      = None
+        self.body                 = None
+        self.compress             = settings.http_compress
         self.content_type         = "text/html"
         self.files                = None
-        self.in_cookies           = {}
         self.in_headers           = { "SERVER_PROTOCOL": "HTTP/1.0" }
         self.out_cookies          = {}
         self.out_headers          = {}
@@ -416,33 +713,45 @@ class HttpClient (Client):
         self.session              = None
         self.write                = self._orig_write
 
+        # cookies and params are parsed the first time they're accessed
+        self.__dict__.pop("in_cookies", None)
+        self.__dict__.pop("params", None)
+
+        # the server counts requests so it can recycle a worker that has served enough of them
+        self._server.count_request()
+
+        line_end = data.find("\r\n")
+
+        if line_end > settings.http_max_request_length:
+            # the request line is over its limit
+            self.handle_max_bytes(settings.http_max_request_length)
+
+            return
+
+        if len(data) - line_end > settings.http_max_headers_length:
+            # the headers are over their limit
+            self.handle_max_bytes(settings.http_max_headers_length)
+
+            return
+
         # parse method, uri and protocol
         try:
-            data                  = data.rstrip()
-            method, uri, protocol = data.split(" ", 2)
+            method, uri, protocol = parser.parse_request_line(data[:line_end])
 
         except:
-            try:
-                method, uri = data.split(" ", 1)
-                protocol    = "HTTP/1.0"
-
-            except:
-                # bad request
-                self.raise_response(response_code.HTTP_400)
+            # bad request
+            self.raise_response(response_code.HTTP_400)
 
-                return
+            return
 
         # verify request
-        method   = method.upper()
-        protocol = protocol.upper()
-
-        if method not in ("CONNECT", "DELETE", "GET", "HEAD", "OPTIONS", "POST", "PUT", "TRACE"):
+        if method not in parser.METHODS:
             # method not allowed
             self.raise_response(response_code.HTTP_405)
 
             return
 
-        if protocol not in ("HTTP/1.0", "HTTP/1.1"):
+        if protocol not in parser.PROTOCOLS:
             # http protocol not supported
             self.raise_response(response_code.HTTP_505)
 
@@ -455,35 +764,24 @@ class HttpClient (Client):
         in_headers = { "HTTP_CONTENT_TYPE": "text/plain",
                        "REMOTE_ADDR":       self._client_address[0],
                        "REMOTE_PORT":       self._client_address[1],
-                       "REQUEST_METHOD":    method.upper(),
+                       "REQUEST_METHOD":    method,
                        "REQUEST_URI":       uri,
                        "REQUEST_URL":       uri,
                        "SERVER_ADDR":       self._server_address[0],
                        "SERVER_PORT":       self._server_address[1],
                        "SERVER_PROTOCOL":   protocol }
 
-        # parse querystring
+        # split querystring
         pos = uri.find("?")
 
         if pos > -1:
-            query_string               = uri[pos + 1:]
-            params                     = urlparse.parse_qs(query_string, True)
-            in_headers["QUERY_STRING"] = query_string
+            in_headers["QUERY_STRING"] = uri[pos + 1:]
             in_headers["REQUEST_URI"]  = uri[:pos]
 
-            for key, value in params.items():
-                if len(value) == 1:
-                    params[key] = value[0]
-
-            self.params = params
-
-        else:
-            self.params = {}
-
         self.in_headers = in_headers
 
-        # read until we hit the end of the headers
-        self.read_delimiter("\r\n\r\n", self.handle_headers, settings.http_max_headers_length)
+        # the headers were read along with the request line
+        self.handle_headers(data[line_end + 2:])
 
     # ------------------------------------------------------------------------------------------------------------------
 
@@ -492,22 +790,24 @@ class HttpClient (Client):
         This callback will be executed when this HttpClient instance is shutting down.
         """
 
-        if self._multipart_file and not self._is_multipart_maxed:
-            # close the current multipart upload file pointer
+        if self._multipart_sink and not self._is_multipart_maxed:
+            # the upload was cut short
             try:
-                self._multipart_file.close()
+                self._multipart_sink.abort()
 
             except:
                 pass
 
-        # delete all temp files
-        for file in self.__files:
+        if self._body_sink:
+            # the content was cut short
             try:
-                os.unlink(file)
+                self._body_sink.abort()
 
             except:
                 pass
 
+        self.__remove_temp_files()
+
         if self.session:
             # save the session
             try:
@@ -533,40 +833,49 @@ class HttpClient (Client):
 
     # ------------------------------------------------------------------------------------------------------------------
 
-    def handle_urlencoded_content (self, data):
+    def handle_upload_sink (self, name, file):
         """
-        This callback will be executed when urlencoded content is ready to be parsed.
+        This callback will be executed when an upload file starts, to choose the sink that its data is passed to as it
+        arrives.
 
-        @param data (str) The content.
-        """
+        By default the upload is written to a temp file within http_upload_dir, which is removed once the next request
+        starts or the client shuts down. The temp file path is stored in file["temp_name"].
 
-        params = self.params
+        @param name (unicode) The upload field name.
+        @param file (dict)    The dict of upload details. Its size is the number of bytes passed to the sink so far.
 
-        for key, value in urlparse.parse_qs(data.rstrip()).items():
-            if key in params:
-                values = params[key]
+        @return (UploadSink) The sink.
+        """
 
-                if type(values) == list:
-                    values.extend(value)
+        chars     = "".join((string.letters, string.digits))
+        temp_name = "/".join((settings.http_upload_dir, "".join([random.choice(chars) for x in xrange(0, 25)])))
 
-                    continue
+        # add temp filename to list
+        self.__files.append(temp_name)
 
-                values      = [values]
-                params[key] = values
+        file["temp_name"] = temp_name
 
-                values.extend(value)
+        return upload.FileSink(temp_name, settings.http_upload_buffer_size)
 
-            else:
-                if len(value) == 1:
-                    # individual param value, so let's extract it out of the list
-                    params[key] = value[0]
+    # ------------------------------------------------------------------------------------------------------------------
 
-                    continue
+    def handle_urlencoded_content (self, data):
+        """
+        This callback will be executed when urlencoded content is ready to be parsed.
 
-                params[key] = value
+        @param data (str) The content.
+        """
+
+        if "params" in self.__dict__:
+            # params have already been accessed
+            self.__merge_params(data)
+
+        else:
+            # parse the content along with the querystring on first access
+            self._form_data = data
 
         # dispatch the client
-        self.handle_dispatch()
+        self.__dispatch()
 
     # ------------------------------------------------------------------------------------------------------------------
 
@@ -576,335 +885,1068 @@ class HttpClient (Client):
         """
 
         if self._static_file:
-            # serving a static file
-            data = self._static_file.read(FILE_READ_SIZE)
+            # the static file has been sent in its entirety and the write queue has closed it
+            self._static_file = None
 
-            if len(data) > 0:
-                # more data to write
-                self.write(data)
-
-            else:
-                # finished reading file
-                self._static_file.close()
-
-                self._static_file = None
-
-        if self._chunked_write_buffer.tell() > 0:
-            self.__chunked_flush()
+        if not self._is_finished:
+            if self._is_headers_written:
+                # the response was written after the dispatch returned
+                self.__finish()
+                self.process_read_buffer()
 
             return
 
-        if self._is_allowing_persistence and self._persistence_type:
-            # allowing another request
-            self.clear_write_buffer()
+        if self._is_pipeline_full:
+            # the client has caught up on the queued responses
+            self._is_pipeline_full = False
 
-            # read until we hit the end of the headers
-            self.read_delimiter("\r\n", self.handle_request, settings.http_max_request_length)
+            self.__read_request()
+            self.process_read_buffer()
 
     # ------------------------------------------------------------------------------------------------------------------
 
-    def multipart_read_delimiter (self, delimiter, callback, max_bytes=0):
+    def multipart_read_delimiter (self, delimiter, callback, max_bytes=0, view=False):
         """
         Read until a certain delimiter has been found within the multipart read buffer.
 
+        An upload is written out as it arrives, so all that is kept between reads is the tail of the buffer that could be
+        the start of a boundary, and the search for the boundary only covers that tail and the data read after it.
+
         @param delimiter (str)    The delimiter to find.
         @param callback  (method) The callback to execute once the delimiter has been found.
-        @param max_bytes (int)    The maximum byte limit to read.
+        @param max_bytes (int)    The maximum byte limit of a form field.
+        @param view      (bool)   Unused. Multipart callbacks are always passed a copy of the data.
         """
 
-        buffer         = self._read_buffer
-        data           = buffer.getvalue()
-        multipart_file = self._multipart_file
-        multipart_name = self._multipart_name
-        params         = self.params
-        pos            = data.find(delimiter)
+        buffer = self._read_buffer
+        pos    = buffer.find(delimiter)
 
-        if not multipart_file:
+        if not self._multipart_sink:
             # form field
+            if max_bytes and (pos > max_bytes or (pos == -1 and len(buffer) > max_bytes)):
+                # the field is over its limit, and the rest of the content can't be trusted
+                self._persistence_type = None
+                self._read_delimiter   = None
+                self.read_delimiter    = self._orig_read_delimiter
+
+                self.handle_max_bytes(max_bytes)
+
+                return
+
             if pos > -1:
                 # boundary has been found
+                multipart_name = self._multipart_name
+                params         = self.params
+                value          = buffer.read(pos + len(delimiter))[:pos]
+
                 if multipart_name in params:
                     if type(params[multipart_name]) != list:
                         # param already existed, but wasn't a list so let's convert it
                         params[multipart_name] = [params[multipart_name]]
 
-                    params[multipart_name].append(data[:pos - 2])
+                    params[multipart_name].append(value)
 
                 else:
-                    params[multipart_name] = data[:pos - 2]
-
-                self.read_delimiter = self._orig_read_delimiter
+                    params[multipart_name] = value
 
-                buffer.truncate(0)
-                buffer.write(data[pos + len(delimiter):])
+                self._events         &= ~self._server.EVENT_READ
+                self._read_delimiter  = None
+                self.read_delimiter   = self._orig_read_delimiter
 
                 # read until we consume 2 bytes (CRLF)
                 self.read_length(2, callback)
 
                 return
 
+        elif pos > -1:
+            # boundary has been found, write the end of the upload
+            self.__write_upload(buffer.view(pos))
+
+            buffer.consume(pos + len(delimiter))
+
+            file                   = self._multipart_upload
+            self._events          &= ~self._server.EVENT_READ
+            self._read_delimiter   = None
+            self.read_delimiter    = self._orig_read_delimiter
+
+            if not self._is_multipart_maxed:
+                self._multipart_sink.close()
+
+            self._multipart_sink   = None
+            self._multipart_upload = None
+
+            self.handle_upload_finished(file)
+
+            # read until we consume 2 bytes (CRLF)
+            self.read_length(2, callback)
+
+            return
+
         else:
-            # file upload
-            file = self.files[multipart_name]
+            # boundary has not been found, so write everything but the tail that could be the start of one
+            length = len(buffer) - len(delimiter) + 1
+
+            if length > 0:
+                self.__write_upload(buffer.view(length))
+
+                buffer.consume(length)
+
+        self._events         |= self._server.EVENT_READ
+        self._read_callback   = callback
+        self._read_delimiter  = delimiter
+        self._read_max_bytes  = max_bytes
+        self._read_view       = False
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def raise_response (self, response_code):
+        """
+        Display a page for the response code.
+
+        @param response_code (str) The response code.
+        """
+
+        try:
+            action = self._server._response_actions[response_code]
 
-            if type(file) == list:
-                file = file[-1]
+        except:
+            pos = response_code.find(" ")
 
             if pos > -1:
-                # boundary has been found, write the buffer minus 2 bytes (for \r\n) to the file
-                self._multipart_file = None
-                self.read_delimiter  = self._orig_read_delimiter
+                raise ClientException("Missing action for response code: %s" % response_code[:pos])
 
-                chunk = data[:pos - 2]
+            else:
+                raise ClientException("Invalid response code: %s" % response_code)
 
-                if not self._is_multipart_maxed:
-                    # flush end contents
-                    multipart_file.write(chunk)
-                    multipart_file.flush()
-                    multipart_file.close()
+        pages = self._server._response_pages.get(response_code)
 
-                    self._read_size = self._orig_read_size
+        if pages and not self._is_headers_written and not self.out_headers and not self.out_cookies and \
+           not self.session and self.content_type == "text/html" and \
+           (not self.compress or pages[0] < settings.http_compress_min_size):
+            # nothing has been added to the response that the pre-rendered one would leave out
+            self._is_headers_written = True
+            self.response_code       = response_code
 
-                    self._multipart_file_size += len(chunk)
+            page = pages[1][(self.in_headers["SERVER_PROTOCOL"], self.__check_persistence(),
+                             self.in_headers.get("REQUEST_METHOD", None) == "HEAD")]
 
-                    if settings.http_max_upload_size and settings.http_max_upload_size < self._multipart_file_size:
-                        # upload is too big
-                        file["error"] = ERROR_UPLOAD_MAX_SIZE
+            Client.write(self, "".join((page[0], self._server._common_headers, page[1])))
 
-                buffer.truncate(0)
-                buffer.write(data[pos + len(delimiter):])
+            return
 
-                file["size"] = os.stat(file["temp_name"]).st_size
+        # execute the action here so any exceptions can be caught by the server
+        getattr(action, self.in_headers.get("REQUEST_METHOD", "GET").lower())(self)
 
-                self.handle_upload_finished(file)
+    # ------------------------------------------------------------------------------------------------------------------
 
-                # read until we consume 2 bytes (CRLF)
-                self.read_length(2, callback)
+    def redirect (self, url):
+        """
+        Redirect the request.
 
-                return
+        @param url (str) The URL.
+        """
+
+        self.out_headers["Location"] = url
+        self.response_code           = response_code.HTTP_307
+
+        self.compose_headers()
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def set_cookie (self, name, value="", expires=None, path="/", domain=None, http_only=False, secure=False):
+        """
+        Set a cookie.
 
-            # boundary has not been found
-            if len(data) >= settings.http_upload_buffer_size:
-                # flush the buffer to file
-                chunk = data[:-len(delimiter)]
+        @param name      (str)      The cookie name.
+        @param value     (str)      The cookie value.
+        @param expires   (datetime) The date and time at which the cookie will expire.
+        @param path      (str)      The root path under which the cookie will be valid.
+        @param domain    (str)      The domain under which the cookie will be valid.
+        @param http_only (bool)     Indicates that the cookie will not be accessible from client script.
+        @param secure    (bool)     Indicates that the cookie will only be transmitted over an HTTPS connection.
+        """
 
-                self._multipart_file_size += len(chunk)
+        cookie = "".join((name, "=", urllib.quote(str(value)), "; path=", path))
 
-                if not self._is_multipart_maxed:
-                    # write another chunk of the file to disk to avoid memory consumption
-                    multipart_file.write(chunk)
-                    multipart_file.flush()
+        if domain:
+            cookie += "; domain=" + domain
 
-                buffer.truncate(0)
-                buffer.write(data[len(data) - len(delimiter):])
+        if expires:
+            # the same expiration is usually set on many responses, so it's only rendered once a second
+            expiration = self._server._cookie_expirations.get(expires)
 
-                # check file size limit
-                if settings.http_max_upload_size and settings.http_max_upload_size < self._multipart_file_size and \
-                   not self._is_multipart_maxed:
-                    # upload is too big
-                    multipart_file.close()
+            if not expiration:
+                expiration = datetime.datetime.fromtimestamp(self._server._date_time + expires) \
+                                              .strftime("%A, %d %B %Y %H:%M:%S GMT" + settings.http_gmt_offset)
 
-                    file["error"]            = ERROR_UPLOAD_MAX_SIZE
-                    self._is_multipart_maxed = True
+                self._server._cookie_expirations[expires] = expiration
 
-        self._events         |= self._server.EVENT_READ
-        self._read_callback   = callback
-        self._read_delimiter  = delimiter
-        self._read_max_bytes  = max_bytes
+            cookie += "; expires=" + expiration
+
+        if http_only:
+            cookie += "; HttpOnly"
+
+        if secure:
+            cookie += "; secure"
+
+        self.out_cookies[name] = cookie
 
     # ------------------------------------------------------------------------------------------------------------------
 
-    def raise_response (self, response_code):
+    def serve_static_file (self, path, filename=None, attachment=True, cache=None):
         """
-        Display a page for the response code.
+        Serve a static file.
 
-        @param response_code (str) The response code.
+        The response carries ETag and Last-Modified validators. A conditional request that still matches them is
+        answered with 304 Not Modified, and a Range request is answered with 206 Partial Content, using a
+        multipart/byteranges body when more than one range has been requested.
+
+        @param path       (str)             The absolute filesystem path to the file.
+        @param filename   (str)             A substitute download filename.
+        @param attachment (bool)            Indicates that the file should be served as a download attachment.
+        @param cache      (StaticFileCache) The cache that small files will be served from.
+
+        @return (bool) True, if the file will be served, otherwise False. Once the response headers have been queued
+                       this is always True, and a failure closes the connection instead.
         """
 
+        entry = cache.get(path) if cache else None
+        file  = None
+
+        if not entry:
+            try:
+                file = open(path, "rb")
+
+            except:
+                # file doesn't exist or permission denied
+                return False
+
         try:
-            action = self._server._response_actions[response_code]
+            in_headers  = self.in_headers
+            out_headers = self.out_headers
+
+            if entry:
+                content_type  = entry.content_type
+                etag          = entry.etag
+                last_modified = entry.last_modified
+                mtime         = entry.mtime
+                size          = entry.size
+
+            else:
+                stat          = os.fstat(file.fileno())
+                size          = stat.st_size
+                mtime         = int(stat.st_mtime)
+                etag          = "\"%x-%x\"" % (mtime, size)
+                last_modified = email.utils.formatdate(mtime, usegmt=True)
+
+                # determine mimetype
+                mimetype = mimetypes.guess_type(path)
+
+                if mimetype[0]:
+                    content_type = mimetype[0]
+
+                elif mimetype[1]:
+                    content_type = "+".join(("text/", mimetype[1]))
+
+                else:
+                    content_type = "text/plain"
+
+                if cache and size <= cache.max_file_size:
+                    entry = cache.add(path, stat, file.read(), content_type, etag, last_modified)
+
+                    if entry:
+                        file.close()
+
+                        file = None
+                        size = entry.size
+
+            data    = entry.data if entry else None
+            headers = entry.headers if entry else None
+
+            if entry and entry.gzip_data and "HTTP_RANGE" not in in_headers and self.__is_accepting_encoding("gzip"):
+                data    = entry.gzip_data
+                etag    = entry.gzip_etag
+                headers = entry.gzip_headers
+                size    = len(data)
+
+            is_modified = self.__is_modified(etag, mtime)
+
+            if headers and is_modified and "HTTP_RANGE" not in in_headers:
+                # the whole cached file is sent, and its header lines have already been rendered
+                if attachment:
+                    out_headers["Content-Disposition"] = "attachment; filename=%s" % \
+                                                         (filename or os.path.basename(path))
+
+                self._static_headers = headers
+
+                self.compose_headers(False)
+
+                if in_headers["REQUEST_METHOD"] != "HEAD":
+                    self.write(data)
+
+                return True
+
+            if entry and entry.gzip_data:
+                out_headers["Vary"] = "Accept-Encoding"
+
+                if data is entry.gzip_data:
+                    out_headers["Content-Encoding"] = "gzip"
+
+            out_headers["Accept-Ranges"] = "bytes"
+            out_headers["ETag"]          = etag
+            out_headers["Last-Modified"] = last_modified
+
+            if not is_modified:
+                # the client copy is still fresh
+                if file:
+                    file.close()
+
+                    file = None
+
+                out_headers.pop("Content-Encoding", None)
+
+                self.response_code = response_code.HTTP_304
+
+                self.compose_headers(False)
+
+                return True
+
+            if attachment:
+                if not filename:
+                    filename = os.path.basename(path)
+
+                out_headers["Content-Disposition"] = "attachment; filename=%s" % filename
+
+            self.content_type = content_type
+
+            ranges = None
+
+            if "HTTP_RANGE" in in_headers and in_headers["REQUEST_METHOD"] == "GET":
+                if_range = in_headers.get("HTTP_IF_RANGE", None)
+
+                if not if_range or if_range == etag or (not if_range.startswith(("\"", "W/")) and \
+                                                        self.__parse_date(if_range) == mtime):
+                    ranges = self.__parse_ranges(in_headers["HTTP_RANGE"], size)
+
+            if ranges == []:
+                # none of the ranges overlap the file
+                if file:
+                    file.close()
+
+                    file = None
+
+                out_headers["Content-Length"] = "0"
+                out_headers["Content-Range"]  = "bytes */%d" % size
+                self.response_code            = response_code.HTTP_416
+
+                self.compose_headers(False)
+
+                return True
+
+            if not ranges:
+                out_headers["Content-Length"] = str(size)
+                ranges                        = ((0, size),)
+
+            elif len(ranges) == 1:
+                offset, length = ranges[0]
+
+                out_headers["Content-Length"] = str(length)
+                out_headers["Content-Range"]  = "bytes %d-%d/%d" % (offset, offset + length - 1, size)
+                self.response_code            = response_code.HTTP_206
+
+            else:
+                # each range is sent as a part of a multipart/byteranges body
+                boundary = "%x" % random.getrandbits(64)
+                parts    = []
+
+                for offset, length in ranges:
+                    parts.append("\r\n--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n" % \
+                                 (boundary, content_type, offset, offset + length - 1, size))
+
+                footer = "\r\n--%s--\r\n" % boundary
+
+                out_headers["Content-Length"] = str(sum([len(part) for part in parts]) + len(footer) +
+                                                    sum([length for offset, length in ranges]))
+                self.content_type             = "multipart/byteranges; boundary=%s" % boundary
+                self.response_code            = response_code.HTTP_206
+
+            self.compose_headers(False)
+
+            if in_headers["REQUEST_METHOD"] == "HEAD":
+                if file:
+                    file.close()
+
+                    file = None
+
+                return True
+
+            if data is not None:
+                # serve the cached file from memory
+                if len(ranges) == 1:
+                    offset, length = ranges[0]
+
+                    self.write(data if length == size else buffer(data, offset, length))
+
+                    return True
+
+                for part, (offset, length) in zip(parts, ranges):
+                    self.write(part)
+                    self.write(buffer(data, offset, length))
+
+                self.write(footer)
+
+                return True
+
+            self._static_file = file
+
+            # queue the file regions, which will be sent straight from the page cache when possible
+            if len(ranges) == 1:
+                file = None
+
+                self.write_file(self._static_file, *ranges[0])
+
+                return True
+
+            file = None
+            last = len(ranges) - 1
+
+            for i, (part, (offset, length)) in enumerate(zip(parts, ranges)):
+                # the regions share the file, and the last one closes it once it has been sent
+                self.write(part)
+                self.write_file(self._static_file, offset, length, close=i == last)
+
+            self.write(footer)
+
+            return True
+
+        except:
+            if file:
+                file.close()
+
+            if not self._is_headers_written:
+                return False
+
+            # part of the response has already been queued, so the client can only be told by closing the connection
+            self._persistence_type = None
+
+            self.clear_write_buffer()
+            self.clear_events()
+
+            if self._static_file:
+                # the region that would have closed the file may not have been queued
+                self._static_file.close()
+
+                self._static_file = None
+
+            return True
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def start_session (self):
+        """
+        Start the session. This is only useful when http_session_autostart is disabled.
+        """
+
+        self.session = settings.http_session_class.load(self.in_cookies.get(settings.http_session_cookie, None))
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def validate (self, types, *args):
+        """
+        Attempt to validate request parameters.
+
+        Note: This will strip all space from string parameters.
+
+        @param types (str) The expected types of the parameters.
+        """
+
+        values = []
+
+        if len(types) != len(args):
+            raise ClientException("Type list is not the same length as the parameter list")
+
+        try:
+            for i, param_type in enumerate(types):
+                param_value = self.params.get(args[i][0], args[i][1])
+
+                if param_value == args[i][1]:
+                    values.append(param_value)
+
+                    continue
+
+                try:
+                    if param_type == "i":
+                        values.append(int(param_value))
+
+                    elif param_type == "f":
+                        values.append(float(param_value))
+
+                    elif param_type == "d":
+                        values.append(decimal.Decimal(param_value))
+
+                    else:
+                        values.append(param_value.strip())
+
+                except:
+                    values.append(args[i][1])
+
+            return values
+
+        except IndexError:
+            raise ClientException("Invalid parameter type")
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __buffered_write (self, data):
+        """
+        Hold data back until the response is finished, or the body grows too large to hold back.
+
+        @param data (str/buffer) The data to write.
+        """
+
+        if data:
+            self._body_buffer.append(data)
+
+            self._body_length += len(data)
+
+            if self._body_length > settings.http_max_buffered_size:
+                self.__stream()
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __check_persistence (self):
+        """
+        Check whether the connection will persist after the current response.
+
+        @return (str) The Connection header value, or None if this client doesn't allow persistence.
+        """
+
+        if self._max_persistent_requests and self._request_count >= self._max_persistent_requests:
+            self._persistence_type = None
+
+        elif self._server._is_shutting_down:
+            # the server is draining its clients, so the connection must not outlive this response
+            self._persistence_type = None
+
+        if not self._is_allowing_persistence:
+            return None
+
+        if self._persistence_type:
+            return "keep-alive"
+
+        return "close"
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __compress (self):
+        """
+        Negotiate a content coding for the response body, and start compressing the body when one has been accepted.
+        """
+
+        out_headers = self.out_headers
+
+        if not self.compress or "Content-Encoding" in out_headers or self.response_code[:3] in ("204", "206", "304") \
+           or self.content_type.lower().startswith(COMPRESSED_TYPES):
+            return
+
+        # the response differs by content coding, even when this client doesn't accept one
+        if "Vary" in out_headers:
+            out_headers["Vary"] += ", Accept-Encoding"
+
+        else:
+            out_headers["Vary"] = "Accept-Encoding"
+
+        if self.__is_accepting_encoding("gzip"):
+            coding = "gzip"
+            wbits  = zlib.MAX_WBITS | 16
+
+        elif self.__is_accepting_encoding("deflate"):
+            coding = "deflate"
+            wbits  = zlib.MAX_WBITS
+
+        else:
+            return
+
+        self._compressor                = zlib.compressobj(settings.http_compress_level, zlib.DEFLATED, wbits)
+        out_headers["Content-Encoding"] = coding
+
+        if out_headers.get("ETag", "").endswith("\""):
+            # the compressed body is a different entity
+            out_headers["ETag"] = "%s-%s\"" % (out_headers["ETag"][:-1], coding)
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __dispatch (self):
+        """
+        Dispatch the request, and finish the response right away when it has been written during the dispatch.
+        """
+
+        self.handle_dispatch()
+
+        if self._is_headers_written and not self._is_finished:
+            self.__finish()
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __enlarge_read_size (self, content_length):
+        """
+        Enlarge the read size so large content is read quicker.
+
+        @param content_length (int) The content length.
+        """
+
+        if content_length >= 1048576:
+            # content is at least a meg, use a rather large read size
+            self._read_size = 131070
+
+        else:
+            # content is potentially large, use a moderate read size
+            self._read_size = 65535
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __finish (self):
+        """
+        Finish the response, and start reading the next request when the connection is persistent.
+
+        The next request may already be sitting in the read buffer, in which case it is handled as soon as the current
+        callback returns, and its response is queued behind this one.
+        """
+
+        self._is_finished = True
+
+        if self._is_buffering:
+            # the entire body is known, so it can be sent with its length
+            self._is_buffering = False
+
+            if self._body_length >= settings.http_compress_min_size:
+                self.__compress()
+
+            if self._compressor:
+                compressor = self._compressor
+                body       = [compressor.compress(data) for data in self._body_buffer]
+
+                body.append(compressor.flush())
+
+                self._body_buffer = ["".join(body)]
+                self._body_length = len(self._body_buffer[0])
+                self._compressor  = None
+
+            self.out_headers["Content-Length"] = str(self._body_length)
+
+            self.__write_headers()
+            self.__write_body()
+
+        elif self._compressor:
+            # the compressor may still be holding on to the end of the body
+            compressor       = self._compressor
+            self._compressor = None
+
+            self.__stream_write(compressor.flush())
+
+        if self.__is_chunked_encoded:
+            Client.write(self, "0\r\n\r\n")
+
+        if not self._is_allowing_persistence or not self._persistence_type:
+            return
+
+        if len(self._write_queue) >= settings.http_max_pipeline_size:
+            # wait for the client to read the queued responses before handling any more requests
+            self._is_pipeline_full = True
+
+            return
+
+        self.__read_request()
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __finish_body (self):
+        """
+        Close the body sink once the request content has been read entirely, and dispatch the request.
+        """
+
+        sink            = self._body_sink
+        self._body_sink = None
+        self._read_size = self._orig_read_size
+
+        sink.close()
+
+        self.__dispatch()
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __is_accepting_encoding (self, encoding):
+        """
+        Check the Accept-Encoding request header for a content coding.
+
+        @param encoding (str) The content coding.
+
+        @return (bool) True, if the client accepts the content coding, otherwise False.
+        """
+
+        for coding in self.in_headers.get("HTTP_ACCEPT_ENCODING", "").split(","):
+            coding = coding.split(";")
+
+            if coding[0].strip().lower() == encoding:
+                for param in coding[1:]:
+                    param = param.strip().lower()
+
+                    if param.startswith("q=") and not param[2:].strip("0. "):
+                        # explicitly refused
+                        return False
+
+                return True
+
+        return False
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __is_modified (self, etag, mtime):
+        """
+        Check the conditional request headers against the validators of a static file.
+
+        @param etag  (str) The entity tag.
+        @param mtime (int) The modification timestamp.
+
+        @return (bool) True, if the file must be sent, otherwise False.
+        """
+
+        in_headers = self.in_headers
+
+        if in_headers["REQUEST_METHOD"] not in ("GET", "HEAD"):
+            return True
+
+        if "HTTP_IF_NONE_MATCH" in in_headers:
+            # an entity tag list takes precedence over the date, and weak comparison is used
+            for tag in in_headers["HTTP_IF_NONE_MATCH"].split(","):
+                tag = tag.strip()
+
+                if tag == "*" or tag == etag or tag == "W/" + etag:
+                    return False
+
+            return True
+
+        if "HTTP_IF_MODIFIED_SINCE" in in_headers:
+            since = self.__parse_date(in_headers["HTTP_IF_MODIFIED_SINCE"])
+
+            return since is None or mtime > since
+
+        return True
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __merge_params (self, data):
+        """
+        Merge urlencoded content into the params. Values of a param that is already set are appended to it.
+
+        @param data (str) The urlencoded content.
+        """
+
+        params = self.params
+
+        for key, value in urlparse.parse_qs(data.rstrip()).items():
+            if key in params:
+                values = params[key]
+
+                if type(values) == list:
+                    values.extend(value)
+
+                    continue
+
+                values      = [values]
+                params[key] = values
+
+                values.extend(value)
+
+            else:
+                if len(value) == 1:
+                    # individual param value, so let's extract it out of the list
+                    params[key] = value[0]
+
+                    continue
+
+                params[key] = value
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __parse_date (self, value):
+        """
+        Parse an HTTP date.
+
+        @param value (str) The date.
+
+        @return (int) The timestamp, or None if the date is invalid.
+        """
+
+        try:
+            return email.utils.mktime_tz(email.utils.parsedate_tz(value))
+
+        except:
+            return None
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __parse_ranges (self, header, size):
+        """
+        Parse a byte Range header.
+
+        @param header (str) The header value.
+        @param size   (int) The file size.
+
+        @return (list) The sorted (offset, length) ranges with overlapping ranges merged, an empty list if no range can
+                       be satisfied, or None if the header is invalid or asks for more than MAX_RANGES disjoint ranges,
+                       and should be ignored.
+        """
+
+        unit, separator, spec = header.partition("=")
+
+        if not separator or unit.strip().lower() != "bytes":
+            return None
+
+        is_parsed = False
+        ranges    = []
+
+        for spec in spec.split(","):
+            spec = spec.strip()
+
+            if not spec:
+                continue
+
+            first, separator, last = spec.partition("-")
+            first                  = first.strip()
+            last                   = last.strip()
+
+            if not separator or (first and not first.isdigit()) or (last and not last.isdigit()) or \
+               not (first or last):
+                return None
+
+            if not first:
+                # suffix range
+                first = max(size - int(last), 0)
+                last  = size - 1
+
+            elif last:
+                first = int(first)
+                last  = int(last)
 
-        except:
-            pos = response_code.find(" ")
+                if last < first:
+                    return None
 
-            if pos > -1:
-                raise ClientException("Missing action for response code: %s" % response_code[:pos])
+                last = min(last, size - 1)
 
             else:
-                raise ClientException("Invalid response code: %s" % response_code)
+                first = int(first)
+                last  = size - 1
 
-        # execute the action here so any exceptions can be caught by the server
-        getattr(action, self.in_headers.get("REQUEST_METHOD", "GET").lower())(self)
+            is_parsed = True
 
-    # ------------------------------------------------------------------------------------------------------------------
+            if first <= last:
+                ranges.append((first, last + 1))
 
-    def redirect (self, url):
-        """
-        Redirect the request.
+        if not is_parsed:
+            return None
 
-        @param url (str) The URL.
-        """
+        ranges.sort()
 
-        self.out_headers["Location"] = url
-        self.response_code           = response_code.HTTP_307
+        merged = []
 
-        self.compose_headers()
+        for start, end in ranges:
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+
+            else:
+                merged.append([start, end])
+
+        if len(merged) > MAX_RANGES:
+            # every range costs a part header and a queued region, so a request for many of them gets the whole file
+            return None
+
+        return [(start, end - start) for start, end in merged]
 
     # ------------------------------------------------------------------------------------------------------------------
 
-    def set_cookie (self, name, value="", expires=None, path="/", domain=None, http_only=False, secure=False):
+    def __read_request (self):
         """
-        Set a cookie.
-
-        @param name      (str)      The cookie name.
-        @param value     (str)      The cookie value.
-        @param expires   (datetime) The date and time at which the cookie will expire.
-        @param path      (str)      The root path under which the cookie will be valid.
-        @param domain    (str)      The domain under which the cookie will be valid.
-        @param http_only (bool)     Indicates that the cookie will not be accessible from client script.
-        @param secure    (bool)     Indicates that the cookie will only be transmitted over an HTTPS connection.
+        Wait for the next request line and headers. The read buffer is not searched until process_read_buffer() is
+        executed.
         """
 
-        cookie = "".join((name, "=", urllib.quote(str(value)), "; path=", path))
+        self._events         |= self._server.EVENT_READ
+        self._read_callback   = self.handle_request
+        self._read_delimiter  = "\r\n\r\n"
+        self._read_max_bytes  = settings.http_max_request_length + settings.http_max_headers_length
+        self._read_view       = False
+        self.read_delimiter   = self._orig_read_delimiter
 
-        if domain:
-            cookie += "; domain=" + domain
+    # ------------------------------------------------------------------------------------------------------------------
 
-        if expires:
-            cookie += "; expires=" + datetime.datetime.fromtimestamp(time.time() + expires) \
-                                             .strftime("%A, %d %B %Y %H:%M:%S GMT" + settings.http_gmt_offset)
+    def __remove_temp_files (self):
+        """
+        Remove the temp files of the uploads that have been received so far.
+        """
 
-        if http_only:
-            cookie += "; HttpOnly"
+        for file in self.__files:
+            try:
+                os.unlink(file)
 
-        if secure:
-            cookie += "; secure"
+            except:
+                pass
 
-        self.out_cookies[name] = cookie
+        self.__files = []
 
     # ------------------------------------------------------------------------------------------------------------------
 
-    def serve_static_file (self, path, filename=None):
+    def __stream (self):
+        """
+        Stop holding the response back. The headers and the body so far are sent, and the rest of the body is sent as
+        it is written.
         """
-        Serve a static file.
 
-        @param path     (str) The absolute filesystem path to the file.
-        @param filename (str) A substitute download filename.
+        if self.in_headers.get("REQUEST_METHOD", None) == "HEAD":
+            # the body is never sent, so only its length needs to be kept
+            self._body_buffer = []
+            self.compress     = False
 
-        @return (bool) True, if the file will be served, otherwise False.
-        """
+            return
 
-        try:
-            file = open(path, "rb")
+        self._is_buffering = False
 
-            self._static_file = file
+        if "Content-Length" in self.out_headers:
+            # the length has been provided
+            self.write = self._orig_write
 
-            if not filename:
-                filename = os.path.basename(path)
+            self.__write_headers()
+            self.__write_body()
 
-            self.out_headers["Content-Disposition"] = "attachment; filename=%s" % filename
+            return
 
-            # determine mimetype
-            mimetype = mimetypes.guess_type(path)
+        self.__compress()
 
-            if mimetype[0]:
-                self.content_type = mimetype[0]
+        if self.in_headers["SERVER_PROTOCOL"] == "HTTP/1.1":
+            self.out_headers["Transfer-Encoding"] = "chunked"
+            self.__is_chunked_encoded             = True
 
-            elif mimetype[1]:
-                self.content_type = "+".join(("text/", mimetype[1]))
+        else:
+            # the end of the body can only be marked by closing the connection
+            self._persistence_type = None
 
-            else:
-                self.content_type = "text/plain"
+        self.write = self.__stream_write
 
-            # compose headers and write the first portion of the file
-            self.compose_headers()
-            self.write(file.read(FILE_READ_SIZE))
+        self.__write_headers()
 
-            return True
+        # the held back body is sent as one chunk
+        body = "".join([data if type(data) is str else str(data) for data in self._body_buffer])
 
-        except:
-            # file doesn't exist or permission denied
-            return False
+        self._body_buffer = []
+        self._body_length = 0
+
+        self.__stream_write(body)
 
     # ------------------------------------------------------------------------------------------------------------------
 
-    def start_session (self):
+    def __stream_write (self, data):
         """
-        Start the session. This is only useful when http_session_autostart is disabled.
+        Compress data when a content coding has been negotiated, and write it as a single chunk when chunked encoding
+        is being used.
+
+        @param data (str/buffer) The data to write.
         """
 
-        self.session = settings.http_session_class.load(self.in_cookies.get(settings.http_session_cookie, None))
+        if self._compressor and data:
+            data = self._compressor.compress(data)
+
+        if not data:
+            return
+
+        if self.__is_chunked_encoded:
+            Client.write(self, "%x\r\n" % len(data))
+            Client.write(self, data)
+            Client.write(self, "\r\n")
+
+        else:
+            Client.write(self, data)
 
     # ------------------------------------------------------------------------------------------------------------------
 
-    def validate (self, types, *args):
+    def __write_body (self):
+        """
+        Queue the held back body.
         """
-        Attempt to validate request parameters.
 
-        Note: This will strip all space from string parameters.
+        body = self._body_buffer
 
-        @param types (str) The expected types of the parameters.
-        """
+        self._body_buffer = []
+        self._body_length = 0
 
-        values = []
+        if self.in_headers.get("REQUEST_METHOD", None) == "HEAD":
+            return
 
-        if len(types) != len(args):
-            raise ClientException("Type list is not the same length as the parameter list")
+        for data in body:
+            Client.write(self, data)
 
-        try:
-            for i, param_type in enumerate(types):
-                param_value = self.params.get(args[i][0], args[i][1])
+    # ------------------------------------------------------------------------------------------------------------------
 
-                if param_value == args[i][1]:
-                    values.append(param_value)
+    def __write_headers (self):
+        """
+        Queue the response head.
+        """
 
-                    continue
+        out_headers = self.out_headers
 
-                try:
-                    if param_type == "i":
-                        values.append(int(param_value))
+        # build the response head, starting with the Date and Server headers the server renders once a second
+        head = [self.in_headers["SERVER_PROTOCOL"], " ", self.response_code, "\r\n", self._server._common_headers]
 
-                    elif param_type == "f":
-                        values.append(float(param_value))
+        if self._static_headers:
+            # a cached static file brings the header lines that describe it, Content-Type included
+            head.append(self._static_headers)
 
-                    elif param_type == "d":
-                        values.append(decimal.Decimal(param_value))
+        elif self.response_code[:3] != "304":
+            # required headers, except on a 304, which must not describe a representation it doesn't carry
+            out_headers["Content-Type"] = self.content_type
 
-                    else:
-                        values.append(param_value.strip())
+        # handle persistence
+        connection = self.__check_persistence()
 
-                except:
-                    values.append(args[i][1])
+        if connection:
+            head.extend(("Connection: ", connection, "\r\n"))
 
-            return values
+        for name, value in out_headers.iteritems():
+            head.extend((name, ": ", value, "\r\n"))
 
-        except IndexError:
-            raise ClientException("Invalid parameter type")
+        for cookie in self.out_cookies.itervalues():
+            head.extend(("Set-Cookie: ", cookie, "\r\n"))
+
+        head.append("\r\n")
+
+        Client.write(self, "".join(head))
 
     # ------------------------------------------------------------------------------------------------------------------
 
-    def __chunked_flush (self):
+    def __write_upload (self, data):
         """
-        Notify the event manager that there is write data available.
+        Pass a chunk of the current upload to its sink. Once the upload is over http_max_upload_size, the sink is closed
+        and the rest of the upload is discarded.
+
+        @param data (memoryview) The chunk.
         """
 
-        # flush using chunked transfer encoding
-        buffer = self._chunked_write_buffer
-        data   = buffer.getvalue()
+        self._multipart_file_size += len(data)
 
-        buffer.truncate(0)
+        if self._is_multipart_maxed:
+            return
 
-        Client.write(self, "".join((hex(len(data))[2:], "\r\n", data, "\r\n")))
-        Client.write(self, "0\r\n")
+        if settings.http_max_upload_size and settings.http_max_upload_size < self._multipart_file_size:
+            # upload is too big
+            self._is_multipart_maxed        = True
+            self._multipart_upload["error"] = ERROR_UPLOAD_MAX_SIZE
 
-    # ------------------------------------------------------------------------------------------------------------------
+            self._multipart_sink.close()
 
-    def __chunked_write (self, data):
-        """
-        Append data onto the write buffer.
-        """
+            return
+
+        self._multipart_sink.write(data)
 
-        self._chunked_write_buffer.write(data)
+        self._multipart_upload["size"] += len(data)
 
 # ----------------------------------------------------------------------------------------------------------------------
 
@@ -1405,7 +2447,13 @@ class HttpServer (Server):
 
         Server.__init__(self, *args, **kwargs)
 
-        self._response_actions = {}
+        self._common_headers     = None # Date and Server header lines for the current second
+        self._cookie_expirations = {}   # cookie expiration dates rendered during the current second
+        self._date_time          = None # the current second
+        self._response_actions   = {}   # response actions, keyed by response code
+        self._response_pages     = {}   # pre-rendered responses, keyed by response code
+
+        self.__render_date(time.time())
 
         # error actions
         self.register_response_action(response_code.HTTP_400, HttpAction)
@@ -1469,7 +2517,7 @@ class HttpServer (Server):
         if not client:
             return
 
-        if not client._is_headers_written:
+        if client.clear_response():
             client.raise_response(response_code.HTTP_500)
 
     # ------------------------------------------------------------------------------------------------------------------
@@ -1492,13 +2540,19 @@ class HttpServer (Server):
 
     # ------------------------------------------------------------------------------------------------------------------
 
-    def register_response_action (self, response_code, action, args=dict()):
+    def register_response_action (self, response_code, action, args=dict(), prerender=True):
         """
         Register a custom response action.
 
+        When the action class is HttpAction itself, its response is pre-rendered for each protocol and persistence
+        status, and raise_response() writes it as is unless the client has added headers, cookies or a session to the
+        response. Any other action class is executed for every response.
+
         @param response_code (str)   The response code under which we're registering the action.
         @param action        (class) The custom action class.
         @param args          (dict)  The action initialization arguments.
+        @param prerender     (bool)  Indicates that the response can be pre-rendered. Disable this to always execute
+                                     the action.
         """
 
         try:
@@ -1511,11 +2565,78 @@ class HttpServer (Server):
             raise ServerException("Invalid error action response code: %s" % response_code)
 
         try:
-            self._response_actions[response_code] = action(self, title=title, response_code=code, **args)
+            self._response_actions[response_code] = action(self, title=title, response_code=response_code, **args)
 
         except Exception, e:
             raise ServerException("Error action for response code %s failed to instantiate: %s" % (code, str(e)))
 
+        if not prerender or action is not HttpAction:
+            self._response_pages.pop(response_code, None)
+
+            return
+
+        # pre-render the response for each protocol and persistence status, with and without the page, leaving out the
+        # Date and Server headers that are rendered once a second
+        page  = self._response_actions[response_code].render_page()
+        pages = {}
+
+        for protocol in parser.PROTOCOLS:
+            status = "%s %s\r\n" % (protocol, response_code)
+
+            for connection in (None, "keep-alive", "close"):
+                head = ["Content-Length: %d" % len(page),
+                        "Content-Type: text/html"]
+
+                if connection:
+                    head.append("Connection: %s" % connection)
+
+                head.append("\r\n")
+
+                head = "\r\n".join(head)
+
+                pages[(protocol, connection, False)] = (status, head + page)
+                pages[(protocol, connection, True)]  = (status, head)
+
+        self._response_pages[response_code] = (len(page), pages)
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def start (self):
+        """
+        Start the infinite loop that iterates file descriptor events.
+        """
+
+        # keep the Date header current (this runs again in each worker, which starts with no timers)
+        self.call_later(0, self.__check_date)
+
+        Server.start(self)
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __check_date (self):
+        """
+        Render the Date header and schedule the next check for the start of the next second.
+        """
+
+        now = time.time()
+
+        self.call_at(int(now) + 1, self.__check_date)
+        self.__render_date(now)
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __render_date (self, now):
+        """
+        Render the header lines that are common to all responses for the current second.
+
+        @param now (float) The current time.
+        """
+
+        self._common_headers     = "Date: %s\r\nServer: %s\r\n" % (email.utils.formatdate(now, usegmt=True),
+                                                                   elements.APP_NAME)
+        self._cookie_expirations = {}
+        self._date_time          = int(now)
+
 # ----------------------------------------------------------------------------------------------------------------------
 
 class RegexRoutingHttpClient (HttpClient):
@@ -1532,8 +2653,11 @@ class RegexRoutingHttpClient (HttpClient):
             match = route[0].match(url)
 
             if match:
-                # update parameters with the matched group data
-                self.params.update(match.groupdict())
+                groupdict = match.groupdict()
+
+                if groupdict:
+                    # update parameters with the matched group data
+                    self.params.update(groupdict)
 
                 if type(route[1]) == tuple:
                     # iterate sub-routes
@@ -1555,16 +2679,113 @@ class RegexRoutingHttpClient (HttpClient):
 
     # ------------------------------------------------------------------------------------------------------------------
 
+    def handle_body_sink (self):
+        """
+        This callback will be executed when the request has content that isn't form data, to let the routed action
+        choose the sink that the content is passed to.
+
+        @return (UploadSink) The sink.
+        """
+
+        action = self.__resolve_route(True)
+
+        if action:
+            sink = action.body_sink(self)
+
+            if sink:
+                return sink
+
+        return HttpClient.handle_body_sink(self)
+
+    # ------------------------------------------------------------------------------------------------------------------
+
     def handle_dispatch (self):
         """
         This callback will be executed when the request has been parsed and needs dispatched to a handler.
         """
 
-        action = self.find_route(self.in_headers["REQUEST_URI"], self._server._routes)
+        action = self.__resolve_route()
+
+        if action is self._server._response_actions[response_code.HTTP_404]:
+            # no route matched, so the response may be pre-rendered
+            self.raise_response(response_code.HTTP_404)
+
+        elif action:
+            if action._compress is not None:
+                # the route overrides the default compression setting
+                self.compress = action._compress
 
-        if action:
             getattr(action, self.in_headers["REQUEST_METHOD"].lower())(self)
 
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def handle_request (self, data):
+        """
+        This callback will be executed when the request line and headers need parsed.
+
+        @param data (str) The data that has tentatively been found as the request line and headers.
+        """
+
+        # the route is found again for each request
+        self.__action    = None
+        self.__is_routed = False
+
+        HttpClient.handle_request(self, data)
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def handle_upload_sink (self, name, file):
+        """
+        This callback will be executed when an upload file starts, to let the routed action choose the sink that its
+        data is passed to.
+
+        @param name (unicode) The upload field name.
+        @param file (dict)    The dict of upload details.
+
+        @return (UploadSink) The sink.
+        """
+
+        action = self.__resolve_route(True)
+
+        if action:
+            sink = action.upload_sink(self, name, file)
+
+            if sink:
+                return sink
+
+        return HttpClient.handle_upload_sink(self, name, file)
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __resolve_route (self, is_receiving=False):
+        """
+        Find the route of the current request, once per request, so the sink lookups and the dispatch share the same
+        action, and the checks of a secure route only run once.
+
+        @param is_receiving (bool) Indicates that the request content hasn't been received yet. A client that is refused
+                                   at this point is answered before its content is read, so the answer must close the
+                                   connection.
+
+        @return (HttpAction) The action, or None if the client has been refused.
+        """
+
+        if self.__is_routed:
+            return self.__action
+
+        persistence_type = self._persistence_type
+
+        if is_receiving:
+            self._persistence_type = None
+
+        self.__action    = self.find_route(self.in_headers["REQUEST_URI"], self._server._routes)
+        self.__is_routed = True
+
+        if not self._is_headers_written:
+            # the client hasn't been answered
+            self._persistence_type = persistence_type
+
+        return self.__action
+
 # ----------------------------------------------------------------------------------------------------------------------
 
 class RegexRoutingHttpServer (HttpServer):
@@ -1701,25 +2922,48 @@ class RegexRoutingHttpServer (HttpServer):
 
 class RoutingHttpClient (HttpClient):
 
+    def handle_body_sink (self):
+        """
+        This callback will be executed when the request has content that isn't form data, to let the routed action
+        choose the sink that the content is passed to.
+
+        @return (UploadSink) The sink.
+        """
+
+        route = self.__resolve_route(True)
+
+        if route and not self.__is_refused:
+            sink = route[1].body_sink(self)
+
+            if sink:
+                return sink
+
+        return HttpClient.handle_body_sink(self)
+
+    # ------------------------------------------------------------------------------------------------------------------
+
     def handle_dispatch (self):
         """
         This callback will be executed when the request has been parsed and needs dispatched to a handler.
         """
 
-        route = self.in_headers["REQUEST_URI"].split(self._server._split_seq, 1)
+        if not self.__resolve_route():
+            # route doesn't exist
+            self.raise_response(response_code.HTTP_404)
 
-        try:
-            pattern, action, is_secure = self._server._routes[route[0]]
+            return
 
-        except:
-            pattern, action, is_secure = None, self._server._response_actions[response_code.HTTP_404], False
+        pattern, action, is_secure = self.__route
 
-        if is_secure:
-            if not action.check_auth(self):
-                return
+        if action._compress is not None:
+            # the route overrides the default compression setting
+            self.compress = action._compress
 
-            if not action.check_credentials(self):
-                return
+        if self.__is_refused:
+            # the client has been answered by the checks of the secure route
+            return
+
+        route = self.in_headers["REQUEST_URI"].split(self._server._split_seq, 1)
 
         if not pattern:
             # route doesn't require validated data
@@ -1730,8 +2974,7 @@ class RoutingHttpClient (HttpClient):
         # check for expected data
         if len(route) == 1:
             # route didn't contain data, so it's automatically invalidated (serve 404 as if the url doesn't exist)
-            getattr(self._server._response_actions[response_code.HTTP_404],
-                    self.in_headers["REQUEST_METHOD"].lower())(self)
+            self.raise_response(response_code.HTTP_404)
 
             return
 
@@ -1740,17 +2983,91 @@ class RoutingHttpClient (HttpClient):
 
         if not match:
             # data did not validate successfully (serve 404 as if the url doesn't exist)
-            getattr(self._server._response_actions[response_code.HTTP_404],
-                    self.in_headers["REQUEST_METHOD"].lower())(self)
+            self.raise_response(response_code.HTTP_404)
 
             return
 
         # data validated successfully
-        self.params.update(match.groupdict())
+        groupdict = match.groupdict()
+
+        if groupdict:
+            self.params.update(groupdict)
 
         getattr(action, self.in_headers["REQUEST_METHOD"].lower())(self)
 
-# ----------------------------------------------------------------------------------------------------------------------
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def handle_request (self, data):
+        """
+        This callback will be executed when the request line and headers need parsed.
+
+        @param data (str) The data that has tentatively been found as the request line and headers.
+        """
+
+        # the route is found again for each request
+        self.__is_refused = False
+        self.__is_routed  = False
+        self.__route      = None
+
+        HttpClient.handle_request(self, data)
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def handle_upload_sink (self, name, file):
+        """
+        This callback will be executed when an upload file starts, to let the routed action choose the sink that its
+        data is passed to.
+
+        @param name (unicode) The upload field name.
+        @param file (dict)    The dict of upload details.
+
+        @return (UploadSink) The sink.
+        """
+
+        route = self.__resolve_route(True)
+
+        if route and not self.__is_refused:
+            sink = route[1].upload_sink(self, name, file)
+
+            if sink:
+                return sink
+
+        return HttpClient.handle_upload_sink(self, name, file)
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __resolve_route (self, is_receiving=False):
+        """
+        Find the route of the current request without validating the data, once per request, so the sink lookups and
+        the dispatch share the same route, and the checks of a secure route only run once.
+
+        @param is_receiving (bool) Indicates that the request content hasn't been received yet. A client that is refused
+                                   at this point is answered before its content is read, so the answer must close the
+                                   connection.
+
+        @return (tuple) The route, or None if the route doesn't exist.
+        """
+
+        if self.__is_routed:
+            return self.__route
+
+        self.__route     = self._server._routes.get(self.in_headers["REQUEST_URI"].split(self._server._split_seq, 1)[0])
+        self.__is_routed = True
+
+        if self.__route and self.__route[2]:
+            # this is a secure url
+            persistence_type = self._persistence_type
+
+            if is_receiving:
+                self._persistence_type = None
+
+            self.__is_refused = not self.__route[1].check_auth(self) or not self.__route[1].check_credentials(self)
+
+            if not self._is_headers_written:
+                # the client hasn't been answered
+                self._persistence_type = persistence_type
+
+        return self.__route
 
 class RoutingHttpServer (HttpServer):
 
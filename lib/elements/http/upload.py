@@ -0,0 +1,219 @@
+# This file is part of Elements.
+# Copyright (c) 2010 Sean Kerr. All rights reserved.
+#
+# The full license is available in the LICENSE file that was distributed with this source code.
+#
+# Author: Sean Kerr <sean@code-box.org>
+
+import hashlib
+import os
+import tempfile
+
+from elements.core.exception import ServerException
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+class UploadSink:
+
+    def abort (self):
+        """
+        This callback will be executed when the client has gone away before the upload was finished.
+        """
+
+        self.close()
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def close (self):
+        """
+        This callback will be executed when the upload has finished, or when it has gone over http_max_upload_size, in
+        which case the upload details hold an error.
+        """
+
+        pass
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def write (self, data):
+        """
+        Write a chunk of the upload. A sink that forwards the data elsewhere must not block, and it must copy the chunk if
+        it holds on to it after returning.
+
+        @param data (memoryview) The chunk, which is only valid until this returns.
+        """
+
+        raise ServerException("UploadSink.write() must be overridden")
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+class DiscardSink (UploadSink):
+
+    def write (self, data):
+        """
+        Discard a chunk of the upload.
+
+        @param data (memoryview) The chunk.
+        """
+
+        pass
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+class FileSink (UploadSink):
+
+    def __init__ (self, path, buffer_size=-1):
+        """
+        Create a new FileSink instance.
+
+        @param path        (str) The absolute filesystem path to which the upload will be written.
+        @param buffer_size (int) The write buffer size. Use -1 for the system default.
+        """
+
+        self.path = path
+
+        self._file = open(path, "wb+", buffer_size)
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def abort (self):
+        """
+        Close and remove the partial file.
+        """
+
+        self._file.close()
+
+        try:
+            os.unlink(self.path)
+
+        except OSError:
+            pass
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def close (self):
+        """
+        Close the file.
+        """
+
+        self._file.close()
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def write (self, data):
+        """
+        Write a chunk of the upload to the file.
+
+        @param data (memoryview) The chunk.
+        """
+
+        self._file.write(data)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+class HashSink (UploadSink):
+
+    def __init__ (self, algorithm="sha1", sink=None):
+        """
+        Create a new HashSink instance.
+
+        This hashes the upload while it's being received, and optionally passes it along to another sink, so the upload
+        can be checksummed without reading it back.
+
+        @param algorithm (str)        The hashlib algorithm name.
+        @param sink      (UploadSink) The sink to which the upload is passed along.
+        """
+
+        self.hash = hashlib.new(algorithm)
+
+        self._sink = sink
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def abort (self):
+        """
+        Abort the sink to which the upload is passed along.
+        """
+
+        if self._sink:
+            self._sink.abort()
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def close (self):
+        """
+        Close the sink to which the upload is passed along.
+        """
+
+        if self._sink:
+            self._sink.close()
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def hexdigest (self):
+        """
+        Retrieve the digest of the data hashed so far.
+
+        @return (str) The hex digest.
+        """
+
+        return self.hash.hexdigest()
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def write (self, data):
+        """
+        Hash a chunk of the upload and pass it along.
+
+        @param data (memoryview) The chunk.
+        """
+
+        self.hash.update(data)
+
+        if self._sink:
+            self._sink.write(data)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+class SpoolSink (UploadSink):
+
+    def __init__ (self, max_size=0, dir=None):
+        """
+        Create a new SpoolSink instance.
+
+        The data is held in memory until it grows over max_size bytes, at which point it's moved to a temp file that has
+        no name on the filesystem.
+
+        @param max_size (int) The maximum number of bytes held in memory. Use 0 to keep everything in memory.
+        @param dir      (str) The absolute filesystem path of the directory in which the temp file will be created.
+        """
+
+        self.file = tempfile.SpooledTemporaryFile(max_size, "w+b", dir=dir)
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def abort (self):
+        """
+        Close the file.
+        """
+
+        self.file.close()
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def close (self):
+        """
+        Rewind the file so it can be read from the start.
+        """
+
+        self.file.seek(0)
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def write (self, data):
+        """
+        Write a chunk to the file.
+
+        @param data (memoryview) The chunk.
+        """
+
+        self.file.write(data)
@@ -19,8 +19,16 @@ io_display_ord  = False
 
 from elements.http.session import MemcacheSession
 
+http_body_spool_size    = 1048576
+http_compress           = False
+http_compress_level     = 6
+http_compress_min_size  = 1024
 http_gmt_offset         = "-5"
+http_max_body_size      = None
+http_max_buffered_size  = 65536
+http_max_field_length   = 65536
 http_max_headers_length = 10000
+http_max_pipeline_size  = 262144
 http_max_request_length = 5000
 http_max_upload_size    = None
 http_memcache_hosts     = ["127.0.0.1:11211"]